@@ -1,7 +1,12 @@
 import dash
+import flask
 import dash_bootstrap_components as dbc
+from time import perf_counter
 from dash import dcc, html
-from dash.dependencies import Input, Output
+from utils.metrics import STAGE_SECONDS, record_bytes, register_gauge, render_prometheus
+from utils.geo_utils import isochrone_cache_stats, GEOCODE_CACHE
+from db.db_connect import pool_stats
+from db.db_support import driver_snapshot_info
 
 # Import your page layouts and callbacks
 
@@ -24,5 +29,31 @@ app.layout = html.Div([
     dash.page_container
 ])
 
+@app.server.before_request
+def start_request_timer():
+    flask.g.request_start = perf_counter()
+
+@app.server.after_request
+def record_callback_request(response):
+    """Latency and response size of every Dash callback request."""
+    if flask.request.path.endswith('/_dash-update-component') and 'request_start' in flask.g:
+        STAGE_SECONDS.observe('http.dash_update_component', perf_counter() - flask.g.request_start)
+        if response.content_length is not None:
+            record_bytes('http.dash_update_component', response.content_length)
+    return response
+
+@app.server.route('/metrics')
+def metrics():
+    """Stage latencies, payload sizes and row counts of every worker and background job on the host, in the Prometheus text format."""
+    return flask.Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+register_gauge('automatch_mysql_pool_in_use', 'MySQL connections checked out per pool',
+               lambda: {pool: stats['in_use'] for pool, stats in pool_stats().items()}, label='pool')
+register_gauge('automatch_driver_snapshot_rows', 'Drivers in the in-memory snapshot',
+               lambda: driver_snapshot_info()['rows'])
+register_gauge('automatch_cache_hit_ratio', 'Hit ratio of the isochrone and geocode caches',
+               lambda: {'isochrones': isochrone_cache_stats()['hit_ratio'], 'geocodes': GEOCODE_CACHE.stats()['hit_ratio']},
+               label='cache')
+
 if __name__ == '__main__':
     app.run_server(debug=True)
\ No newline at end of file
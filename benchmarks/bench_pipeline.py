@@ -0,0 +1,158 @@
+import os
+
+# The pipeline modules read these at import time; nothing here connects to MySQL, GraphHopper or Mapbox
+for name, value in {"KND_HOST": "localhost", "KND_USER": "bench", "KND_PASSWORD": "bench", "KND_NAME": "bench",
+                    "MYSQL_ROOT_PWD": "bench", "MAPBOX_TOKEN": "bench"}.items():
+    os.environ.setdefault(name, value)
+
+import gc
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tracemalloc
+from time import perf_counter
+import numpy as np
+import pydeck as pdk
+from db.db_support import drivers_frames
+from utils.geo_utils import (
+    simplify_isochrones, label_drivers_by_isochrones, partitions_from_labels, partition_drivers_by_isochrones,
+    check_partitions_intersection, RENDER_SIMPLIFY_TOLERANCE, CONTAINMENT_SIMPLIFY_TOLERANCE,
+)
+from utils.deck_utils import build_drivers_layer, deck_data
+from utils.table_utils import build_partition_tables
+from benchmarks.synthetic import synthetic_drivers, synthetic_isochrones
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+DEFAULT_VERTICES = [100, 1_000, 10_000]
+DEFAULT_TIMES = [5, 10, 15, 20, 25, 30]
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+# Columns the callback drops before caching partitions and building tables
+TABLE_DROP_COLUMNS = ['geometry', 'lat', 'lng', 'zip_code', 'province', 'city', 'country']
+
+
+def measure(fn, repeat):
+    """
+    Run fn `repeat` times for timing, then once more under tracemalloc for its peak memory.
+
+    :return: (result of the last run, dict with min/median/max seconds and peak traced bytes)
+    """
+    seconds = []
+    for _ in range(repeat):
+        gc.collect()
+        start = perf_counter()
+        result = fn()
+        seconds.append(perf_counter() - start)
+    del result
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, {
+        "min_seconds": min(seconds),
+        "median_seconds": float(np.median(seconds)),
+        "max_seconds": max(seconds),
+        "peak_bytes": peak,
+    }
+
+def build_deck(isochrones, drivers_layer):
+    """The deck update_map_and_tables renders after a Submit, minus the icon."""
+    isochrone_layer = pdk.Layer(
+        "GeoJsonLayer",
+        data=isochrones,
+        opacity=0.1,
+        stroked=False,
+        filled=True,
+        extruded=False,
+        wireframe=True
+    )
+    return pdk.Deck(
+        layers=[isochrone_layer, drivers_layer],
+        initial_view_state=pdk.ViewState(latitude=40.4168, longitude=-3.7038, zoom=9),
+    )
+
+def run_benchmarks(sizes=DEFAULT_SIZES, vertices=DEFAULT_VERTICES, times=DEFAULT_TIMES, repeat=3, seed=0):
+    """
+    Benchmark every stage for every driver count and isochrone vertex count.
+
+    :return: list of result dicts with the stage, drivers, vertices and measurements
+    """
+    results = []
+
+    def record(stage, fn, drivers=None, vertex_count=None):
+        result, measurement = measure(fn, repeat)
+        results.append({"stage": stage, "drivers": drivers, "vertices": vertex_count, **measurement})
+        print(f"{stage:<32} drivers={drivers or '-':>9} vertices={vertex_count or '-':>6} "
+              f"median={measurement['median_seconds'] * 1000:10.1f} ms  peak={measurement['peak_bytes'] / 2**20:8.1f} MiB")
+        return result
+
+    isochrones = {}
+    for vertex_count in vertices:
+        raw = synthetic_isochrones(times, vertex_count, seed=seed)
+        render = record("simplify_isochrones.render",
+                        lambda: simplify_isochrones(raw, RENDER_SIMPLIFY_TOLERANCE)[0], vertex_count=vertex_count)
+        containment = record("simplify_isochrones.containment",
+                             lambda: simplify_isochrones(raw, CONTAINMENT_SIMPLIFY_TOLERANCE)[0], vertex_count=vertex_count)
+        isochrones[vertex_count] = (raw, render, containment)
+
+    for n in sizes:
+        drivers_df = synthetic_drivers(n, seed=seed)
+        _, drivers_gdf = record("drivers_frames", lambda: drivers_frames(drivers_df.copy()), drivers=n)
+        for mode in ("compact", "records"):
+            record(f"build_drivers_layer.{mode}", lambda: build_drivers_layer(drivers_gdf, mode), drivers=n)
+        drivers_layer = build_drivers_layer(drivers_gdf)
+
+        for vertex_count, (raw, render, containment) in isochrones.items():
+            labels = record("label_drivers_by_isochrones",
+                            lambda: label_drivers_by_isochrones(drivers_gdf, containment), n, vertex_count)
+            num_partitions = len(containment["features"]) + 1
+            partitions = record("partitions_from_labels",
+                                lambda: partitions_from_labels(drivers_gdf, labels, num_partitions), n, vertex_count)
+            record("partition_drivers_by_isochrones",
+                   lambda: partition_drivers_by_isochrones(drivers_gdf, raw), n, vertex_count)
+            record("check_partitions_intersection",
+                   lambda: check_partitions_intersection(partitions), n, vertex_count)
+            table_partitions = record(
+                "drop_table_columns",
+                lambda: [partition.drop(columns=TABLE_DROP_COLUMNS).reset_index(drop=True) for partition in partitions],
+                n, vertex_count)
+            record("build_partition_tables",
+                   lambda: build_partition_tables(table_partitions, [times[0], times[-1]]), n, vertex_count)
+            record("deck_to_json", lambda: deck_data(build_deck(render, drivers_layer)), n, vertex_count)
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the match pipeline on synthetic data, fully offline")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="driver counts")
+    parser.add_argument("--vertices", type=int, nargs="+", default=DEFAULT_VERTICES, help="vertices per isochrone ring")
+    parser.add_argument("--times", type=int, nargs="+", default=DEFAULT_TIMES, help="isochrone limits in minutes")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per stage")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON results file (default: benchmarks/results/<timestamp>.json)")
+    args = parser.parse_args()
+
+    started_at = time.strftime("%Y%m%dT%H%M%S")
+    results = run_benchmarks(args.sizes, args.vertices, sorted(args.times), args.repeat, args.seed)
+    output = args.output or os.path.join(RESULTS_DIR, f"{started_at}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "started_at": started_at,
+            "commit": git_commit(),
+            "python": sys.version,
+            "platform": platform.platform(),
+            "parameters": vars(args),
+            "results": results,
+        }, f, indent=2)
+    print(f"Results written to {output}")
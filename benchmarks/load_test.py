@@ -0,0 +1,166 @@
+import json
+import time
+import argparse
+import platform
+import itertools
+import threading
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+import requests as req
+
+# Multi-output keys of the page's callbacks, as the Dash renderer sends them
+SEARCH_OUTPUT = "..search-store.data...alert-fail-geoencode.is_open.."
+RENDER_OUTPUT = "..map.data...data-tables-container.children...partition-token-store.data.."
+
+
+def percentile(values, q):
+    """Nearest-rank q-th percentile of values, or None if there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))]
+
+def search_payload(n_clicks, street, zip_code, time_limits):
+    return {
+        "output": SEARCH_OUTPUT,
+        "outputs": [{"id": "search-store", "property": "data"}, {"id": "alert-fail-geoencode", "property": "is_open"}],
+        "inputs": [{"id": "submit-val", "property": "n_clicks", "value": n_clicks}],
+        "changedPropIds": ["submit-val.n_clicks"],
+        "state": [
+            {"id": "street-input", "property": "value", "value": street},
+            {"id": "zip-code-input", "property": "value", "value": zip_code},
+            {"id": "time-limit-range-slider", "property": "value", "value": time_limits},
+            # Live routing, so every search reaches GraphHopper instead of the precomputed grid
+            {"id": "live-routing-checklist", "property": "value", "value": ["live"]},
+        ],
+    }
+
+def render_payload(search_store):
+    return {
+        "output": RENDER_OUTPUT,
+        "outputs": [
+            {"id": "map", "property": "data"},
+            {"id": "data-tables-container", "property": "children"},
+            {"id": "partition-token-store", "property": "data"},
+        ],
+        "inputs": [
+            {"id": "search-store", "property": "data", "value": search_store},
+            {"id": "shifts-dropdown", "property": "value", "value": None},
+            {"id": "managers-dropdown", "property": "value", "value": None},
+        ],
+        "changedPropIds": ["search-store.data"],
+        "state": [],
+    }
+
+def update_component(session, base_url, payload, timeout, poll_interval=0.2):
+    """
+    POST one callback request and return its response dict.
+
+    Background callbacks answer with a job to poll; the same request is then repeated
+    with the job's cacheKey until the result is ready, as the Dash renderer does.
+    """
+    url = f"{base_url}/_dash-update-component"
+    deadline = perf_counter() + timeout
+    response = session.post(url, json=payload, timeout=timeout)
+    response.raise_for_status()
+    body = response.json()
+    while "response" not in body and "cacheKey" in body:
+        if perf_counter() > deadline:
+            raise TimeoutError(f"Background job {body.get('job')} did not finish within {timeout}s")
+        time.sleep(poll_interval)
+        response = session.post(url, json=payload, params={"cacheKey": body["cacheKey"], "job": body["job"]}, timeout=timeout)
+        response.raise_for_status()
+        body = {**body, **response.json()} if response.content else body
+    return body.get("response", {})
+
+
+class LoadTest:
+    """Simulated users each submitting a search and rendering its map and tables."""
+
+    def __init__(self, base_url, addresses, time_limits, timeout):
+        self.base_url = base_url.rstrip("/")
+        self.addresses = addresses
+        self.time_limits = time_limits
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._next_address = itertools.count()
+        self.search_seconds, self.render_seconds, self.total_seconds = [], [], []
+        self.errors = 0
+
+    def session(self):
+        if getattr(self._local, "session", None) is None:
+            self._local.session = req.Session()
+        return self._local.session
+
+    def one_user(self, i):
+        with self._lock:
+            street, zip_code = self.addresses[next(self._next_address) % len(self.addresses)]
+        start = perf_counter()
+        try:
+            response = update_component(self.session(), self.base_url, search_payload(i + 1, street, zip_code, self.time_limits), self.timeout)
+            searched = perf_counter()
+            search_store = response.get("search-store", {}).get("data")
+            if search_store is None:
+                raise ValueError(f"No search result for {street}, {zip_code}")
+            update_component(self.session(), self.base_url, render_payload(search_store), self.timeout)
+        except (req.RequestException, ValueError, TimeoutError) as e:
+            with self._lock:
+                self.errors += 1
+            print(f"Request {i} failed: {e}")
+            return
+        done = perf_counter()
+        with self._lock:
+            self.search_seconds.append(searched - start)
+            self.render_seconds.append(done - searched)
+            self.total_seconds.append(done - start)
+
+    def run(self, concurrency, users):
+        """Run `users` simulated users, `concurrency` at a time; return the throughput and latency report."""
+        self.search_seconds, self.render_seconds, self.total_seconds, self.errors = [], [], [], 0
+        start = perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(self.one_user, range(users)))
+        elapsed = perf_counter() - start
+        report = {
+            "concurrency": concurrency,
+            "users": users,
+            "errors": self.errors,
+            "seconds": elapsed,
+            # Completed users (one search and one render each) per second
+            "throughput": len(self.total_seconds) / elapsed if elapsed else 0.0,
+        }
+        for name, values in (("search", self.search_seconds), ("render", self.render_seconds), ("total", self.total_seconds)):
+            for q in (50, 95, 99):
+                report[f"{name}_p{q}"] = percentile(values, q)
+        return report
+
+def format_seconds(value):
+    return f"{value * 1000:8.0f}" if value is not None else "       -"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fire concurrent search + render callbacks at a running app and report throughput and tail latency")
+    parser.add_argument("--url", default="http://127.0.0.1:8050", help="base URL of the Dash app")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="concurrent users per run")
+    parser.add_argument("--users", type=int, default=50, help="users per concurrency level")
+    parser.add_argument("--time-limits", type=int, nargs=2, default=[5, 30], help="range slider values in minutes")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds before a request counts as failed")
+    parser.add_argument("--label", default="", help="worker configuration under test, e.g. 'gunicorn -w 4, background'")
+    parser.add_argument("--output", help="append the reports to this JSON-lines file")
+    args = parser.parse_args()
+
+    # One address per user, so no search is answered by the geocode or isochrone caches
+    addresses = [(f"Calle Load Test {i}", f"280{i % 80 + 1:02d}") for i in range(args.users * len(args.concurrency))]
+    load_test = LoadTest(args.url, addresses, args.time_limits, args.timeout)
+
+    print(f"{'users':>6} {'conc':>5} {'errors':>6} {'users/s':>7}   search p50/p95/p99 ms          render p50/p95/p99 ms")
+    for concurrency in args.concurrency:
+        report = load_test.run(concurrency, args.users)
+        report.update(label=args.label, url=args.url, platform=platform.platform(), finished_at=time.time())
+        print(f"{report['users']:>6} {concurrency:>5} {report['errors']:>6} {report['throughput']:>7.2f}   "
+              f"{format_seconds(report['search_p50'])}{format_seconds(report['search_p95'])}{format_seconds(report['search_p99'])}   "
+              f"{format_seconds(report['render_p50'])}{format_seconds(report['render_p95'])}{format_seconds(report['render_p99'])}")
+        if args.output:
+            with open(args.output, "a", encoding="utf-8") as f:
+                f.write(json.dumps(report) + "\n")
@@ -0,0 +1,129 @@
+import math
+import json
+import time
+import random
+import hashlib
+import argparse
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Bounding box the stand-in geocoder places addresses in, as (min lon, min lat, max lon, max lat)
+MADRID_BBOX = (-3.85, 40.32, -3.55, 40.52)
+
+
+def isochrone_polygons(lat, lon, time_limit, buckets, vertices, seed):
+    """
+    GraphHopper-shaped nested polygons around a point, one per bucket.
+
+    Ring radius grows with its share of time_limit; all rings share one radial
+    wobble, so bucket i always contains bucket i - 1.
+    """
+    rng = random.Random(seed)
+    harmonics = [(frequency, rng.uniform(0, 0.25 / frequency), rng.uniform(0, 2 * math.pi)) for frequency in range(2, 9)]
+    angles = [2 * math.pi * i / vertices for i in range(vertices)]
+    wobble = [
+        (1 + sum(amplitude * math.sin(frequency * angle + phase) for frequency, amplitude, phase in harmonics))
+        * (1 + rng.uniform(-0.02, 0.02))
+        for angle in angles
+    ]
+    polygons = []
+    for bucket in range(buckets):
+        # ~0.004 degrees of latitude per minute of driving
+        radius = 0.004 * time_limit / 60 * (bucket + 1) / buckets
+        ring = [
+            [round(lon + radius * w * math.cos(angle) * 1.3, 6), round(lat + radius * w * math.sin(angle), 6)]
+            for angle, w in zip(angles, wobble)
+        ]
+        ring.append(ring[0])
+        polygons.append({
+            "type": "Feature",
+            "properties": {"bucket": bucket},
+            "geometry": {"type": "Polygon", "coordinates": [ring]},
+        })
+    return polygons
+
+def geocode(query):
+    """Deterministic coordinates inside MADRID_BBOX for any query string."""
+    digest = hashlib.sha1(query.strip().lower().encode()).digest()
+    min_lon, min_lat, max_lon, max_lat = MADRID_BBOX
+    x = int.from_bytes(digest[:4], "big") / 2**32
+    y = int.from_bytes(digest[4:8], "big") / 2**32
+    return min_lat + y * (max_lat - min_lat), min_lon + x * (max_lon - min_lon)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Serves GraphHopper's /isochrone and Nominatim's /search with simulated latency and failures."""
+
+    protocol_version = "HTTP/1.1"
+    config = None
+
+    def log_message(self, format, *args):
+        if self.config.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def simulate(self, latency, jitter, error_rate):
+        """Sleep for the configured latency; return True if this request should fail."""
+        time.sleep(max(0.0, latency + random.uniform(-jitter, jitter)))
+        return random.random() < error_rate
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        config = self.config
+        if url.path == "/isochrone":
+            if self.simulate(config.isochrone_latency, config.jitter, config.isochrone_error_rate):
+                return self.send_json(503, {"message": "Simulated GraphHopper failure"})
+            try:
+                lat, lon = (float(value) for value in params["point"].split(","))
+                time_limit = int(params.get("time_limit", 600))
+                buckets = int(params.get("buckets", 1))
+            except (KeyError, ValueError):
+                return self.send_json(400, {"message": "Invalid point, time_limit or buckets"})
+            polygons = isochrone_polygons(lat, lon, time_limit, buckets, config.vertices, seed=params["point"])
+            return self.send_json(200, {"polygons": polygons, "info": {"copyrights": ["stand-in"], "took": 0}})
+        if url.path == "/search":
+            if self.simulate(config.search_latency, config.jitter, config.search_error_rate):
+                return self.send_json(503, {"error": "Simulated Nominatim failure"})
+            query = params.get("q", "")
+            if not query or random.random() < config.not_found_rate:
+                return self.send_json(200, [])
+            lat, lon = geocode(query)
+            return self.send_json(200, [{"lat": f"{lat:.7f}", "lon": f"{lon:.7f}", "display_name": query}])
+        self.send_json(404, {"message": f"Unknown path {url.path}"})
+
+
+def serve(config):
+    handler = type("ConfiguredStandInHandler", (StandInHandler,), {"config": config})
+    server = ThreadingHTTPServer((config.host, config.port), handler)
+    server.daemon_threads = True
+    base = f"http://{config.host}:{config.port}"
+    print(f"Stand-in GraphHopper/Nominatim listening on {base}")
+    print(f"Point the app at it with GRAPHHOPPER_URL={base}/isochrone NOMINATIM_URL={base}/search NOMINATIM_MIN_INTERVAL=0")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for GraphHopper /isochrone and Nominatim /search")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8990)
+    parser.add_argument("--isochrone-latency", type=float, default=0.2, help="seconds per /isochrone response")
+    parser.add_argument("--search-latency", type=float, default=0.1, help="seconds per /search response")
+    parser.add_argument("--jitter", type=float, default=0.05, help="uniform +/- seconds added to every latency")
+    parser.add_argument("--isochrone-error-rate", type=float, default=0.0, help="share of /isochrone requests answered 503")
+    parser.add_argument("--search-error-rate", type=float, default=0.0, help="share of /search requests answered 503")
+    parser.add_argument("--not-found-rate", type=float, default=0.0, help="share of /search requests with no result")
+    parser.add_argument("--vertices", type=int, default=500, help="vertices per isochrone polygon")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    serve(parser.parse_args())
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+
+# Center and spread of synthetic driver homes, roughly the Madrid metropolitan area
+MADRID_CENTER = (40.4168, -3.7038)
+MADRID_SPREAD = (0.12, 0.15)
+SHIFTS = ["Morning", "Afternoon", "Night", "Weekend"]
+MANAGERS = [f"Manager {i}" for i in range(40)]
+
+
+def synthetic_drivers(n, seed=0) -> pd.DataFrame:
+    """
+    n drivers shaped like the rows of the driver query, with homes scattered around Madrid.
+
+    Columns: kendra_id, name, street, city, country, zip_code, lat, lng, province,
+    manager, shift and is_matched.
+    """
+    rng = np.random.default_rng(seed)
+    lat = rng.normal(MADRID_CENTER[0], MADRID_SPREAD[0], n)
+    lng = rng.normal(MADRID_CENTER[1], MADRID_SPREAD[1], n)
+    street_numbers = rng.integers(1, 200, n)
+    streets = rng.integers(0, 5000, n)
+    return pd.DataFrame({
+        "kendra_id": np.arange(1, n + 1),
+        "name": [f"Driver {i}" for i in range(1, n + 1)],
+        "street": [f"Calle {street} {number}" for street, number in zip(streets.tolist(), street_numbers.tolist())],
+        "city": "Madrid",
+        "country": "ES",
+        "zip_code": [f"280{code:02d}" for code in rng.integers(1, 80, n).tolist()],
+        "lat": lat,
+        "lng": lng,
+        "province": "Madrid",
+        "manager": np.array(MANAGERS, dtype=object)[rng.integers(0, len(MANAGERS), n)],
+        "shift": np.array(SHIFTS, dtype=object)[rng.integers(0, len(SHIFTS), n)],
+        "is_matched": rng.random(n) < 0.3,
+    })
+
+def synthetic_isochrones(times, vertices, center=MADRID_CENTER, seed=0) -> dict:
+    """
+    Nested, irregular isochrone rings around center in the GraphHopper response shape.
+
+    Every ring has `vertices` vertices. All rings share one smooth radial wobble and
+    grow with their time limit, so ring i always contains ring i - 1.
+
+    :param times: Time limits in minutes, innermost first
+    :return: FeatureCollection with one Polygon feature per time limit
+    """
+    rng = np.random.default_rng(seed)
+    angles = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    wobble = np.ones(vertices)
+    for frequency in range(2, 9):
+        wobble += rng.uniform(0, 0.25 / frequency) * np.sin(frequency * angles + rng.uniform(0, 2 * np.pi))
+    # Fine-grained noise, as on real road-network isochrones, scaled so rings stay nested
+    wobble *= 1 + rng.uniform(-0.02, 0.02, vertices)
+
+    features = []
+    for bucket, minutes in enumerate(times):
+        radius = 0.004 * minutes * wobble
+        ring = np.column_stack([center[1] + radius * np.cos(angles) * 1.3, center[0] + radius * np.sin(angles)])
+        ring = np.vstack([ring, ring[:1]])
+        features.append({
+            "type": "Feature",
+            "properties": {"bucket": bucket},
+            "geometry": {"type": "Polygon", "coordinates": [ring.tolist()]},
+        })
+    return dict(type="FeatureCollection", features=features)
@@ -0,0 +1,38 @@
+import re
+import unicodedata
+
+# Characters of DriverSnapshot.address_key
+ADDRESS_KEY_LENGTH = 300
+# Common Spanish street-type abbreviations, expanded so "C/ Mayor" and "Calle Mayor" share a key
+STREET_ABBREVIATIONS = {
+    "c": "calle",
+    "cl": "calle",
+    "av": "avenida",
+    "avd": "avenida",
+    "avda": "avenida",
+    "pº": "paseo",
+    "po": "paseo",
+    "pl": "plaza",
+    "pza": "plaza",
+    "ctra": "carretera",
+    "cra": "carretera",
+}
+
+
+def normalize_address(street, postal_code) -> str:
+    """
+    Canonical key of a (street, postal code) pair.
+
+    Lowercases, strips accents and punctuation, expands street-type abbreviations and
+    collapses whitespace, so trivially different spellings of one address share a key.
+    """
+    text = unicodedata.normalize("NFKD", str(street or "").lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    words = re.sub(r"[^\w]+", " ", text).split()
+    words = [STREET_ABBREVIATIONS.get(word, word) for word in words]
+    postal_code = re.sub(r"\s+", "", str(postal_code or ""))
+    return f"{' '.join(words)}|{postal_code}"
+
+def address_key(street, postal_code) -> str:
+    """normalize_address() cut to the length of the indexed DriverSnapshot.address_key column."""
+    return normalize_address(street, postal_code)[:ADDRESS_KEY_LENGTH]
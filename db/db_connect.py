@@ -1,6 +1,9 @@
 import pymysql
-from time import sleep
+from time import sleep, monotonic, perf_counter
+from contextlib import contextmanager
 import os
+import queue
+import threading
 
 kndauth = {
     "host" : os.environ['KND_HOST'],
@@ -16,7 +19,17 @@ localauth = {
     "database": "autopulse"
 }
 
-def connect(auth):
+# Seconds connect() keeps retrying before giving up
+CONNECT_DEADLINE = float(os.getenv("MYSQL_CONNECT_DEADLINE", 30))
+# Connections kept per (host, user, database)
+POOL_SIZE = int(os.getenv("MYSQL_POOL_SIZE", 5))
+# Seconds a checkout waits for a free connection before raising PoolExhausted
+POOL_TIMEOUT = float(os.getenv("MYSQL_POOL_TIMEOUT", 30))
+
+def connect(auth, deadline=CONNECT_DEADLINE, max_delay=8.0):
+    """Open a connection, retrying with exponential backoff until `deadline` seconds have passed."""
+    start = monotonic()
+    delay = 0.25
     while True:
         try:
             return pymysql.connect(
@@ -27,8 +40,164 @@ def connect(auth):
                 # autocommit=True
             )
         except pymysql.MySQLError as e:
-            print(f"Failed to connect to MySQL: {e}")
-            sleep(1)
+            if monotonic() - start + delay > deadline:
+                print(f"Failed to connect to MySQL: {e}. Giving up after {monotonic() - start:.1f}s")
+                raise
+            print(f"Failed to connect to MySQL: {e}. Retrying in {delay:.2f}s")
+            sleep(delay)
+            delay = min(delay * 2, max_delay)
+
+class PoolExhausted(RuntimeError):
+    """Raised when no pooled connection became free within the pool timeout."""
+
+class ConnectionPool:
+    """
+    Bounded pool of pymysql connections for one set of credentials.
+
+    Connections are health-checked with a ping on checkout and rolled back on
+    return, so the next user never sees a stale transaction snapshot. A connection
+    whose user raised is closed instead of being returned.
+    """
+
+    def __init__(self, auth, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.auth = dict(auth)
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.saturated_checkouts = 0
+        self.timeouts = 0
+        self.health_check_failures = 0
+        self.connections_opened = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _acquire_slot(self):
+        start = perf_counter()
+        saturated = not self._slots.acquire(blocking=False)
+        if saturated and not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise PoolExhausted(f"No MySQL connection to {self.auth['host']} free after {self.timeout}s")
+        waited = perf_counter() - start
+        with self._lock:
+            self.checkouts += 1
+            self.saturated_checkouts += saturated
+            self.total_wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+    def _release_slot(self):
+        with self._lock:
+            self.in_use -= 1
+        self._slots.release()
+
+    def _checkout(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = connect(self.auth)
+                with self._lock:
+                    self.connections_opened += 1
+                return conn
+            try:
+                conn.ping(reconnect=False)
+                return conn
+            except pymysql.MySQLError:
+                with self._lock:
+                    self.health_check_failures += 1
+                conn.close()
+
+    @staticmethod
+    def _discard(conn):
+        try:
+            conn.close()
+        except pymysql.MySQLError:
+            pass  # Already closed or broken; nothing left to release
+
+    @contextmanager
+    def connection(self):
+        self._acquire_slot()
+        try:
+            conn = self._checkout()
+        except BaseException:
+            self._release_slot()
+            raise
+        # Any exit other than a clean one, including GeneratorExit from a generator closed
+        # mid-stream and KeyboardInterrupt, discards the connection; the slot is always returned
+        clean = False
+        try:
+            yield conn
+            clean = True
+        finally:
+            try:
+                if clean:
+                    try:
+                        conn.rollback()
+                        self._idle.put(conn)
+                    except pymysql.MySQLError:
+                        self._discard(conn)
+                else:
+                    self._discard(conn)
+            finally:
+                self._release_slot()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": self.size,
+                "in_use": self.in_use,
+                "idle": self._idle.qsize(),
+                "peak_in_use": self.peak_in_use,
+                "checkouts": self.checkouts,
+                "saturated_checkouts": self.saturated_checkouts,
+                "timeouts": self.timeouts,
+                "health_check_failures": self.health_check_failures,
+                "connections_opened": self.connections_opened,
+                "total_wait_seconds": self.total_wait_seconds,
+                "max_wait_seconds": self.max_wait_seconds,
+            }
+
+_pools = {}
+_pools_lock = threading.Lock()
+_pools_pid = os.getpid()
+
+def _after_fork_in_child():
+    # Another thread of the parent may have held the registry lock when a background job was forked
+    global _pools_lock
+    _pools_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+def get_pool(auth):
+    """Shared ConnectionPool for these credentials, created on first use in each process."""
+    global _pools_pid
+    key = (auth['host'], auth['user'], auth.get('database'))
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            # A forked child, such as a background callback job, must not reuse the parent's sockets
+            _pools.clear()
+            _pools_pid = os.getpid()
+        if key not in _pools:
+            _pools[key] = ConnectionPool(auth)
+        return _pools[key]
+
+def pooled_connection(auth):
+    """Context manager lending a pooled connection; use in place of `with connect(auth) as conn`."""
+    return get_pool(auth).connection()
+
+def pool_stats():
+    """Wait-time and saturation metrics of every pool, keyed by host/database."""
+    with _pools_lock:
+        pools = dict(_pools)
+    return {f"{host}/{database}": pool.stats() for (host, user, database), pool in pools.items()}
 
 auroids = [5, 53, 56, 57, 59, 64, 123, 131, 132, 229, 234, 248, 62, 535]
 
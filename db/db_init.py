@@ -1,27 +1,16 @@
+import sys
+import argparse
 from db_connect import *
-
-def connect(auth):
-    while True:
-        try:
-            return pymysql.connect(
-                host=auth['host'],
-                user=auth['user'],
-                password=auth['password'],
-                database=auth.get('database', None),
-                # autocommit=True
-            )
-        except pymysql.MySQLError as e:
-            print(f"Failed to connect to MySQL: {e}")
-            sleep(1)
+from db_scheduler import run_steps
 
 def create_autopulse_db():
-    with connect({**localauth, 'database': None}) as conn:
+    with pooled_connection({**localauth, 'database': None}) as conn:
         with conn.cursor() as cursor:
             cursor.execute("CREATE DATABASE IF NOT EXISTS autopulse;")
     localauth['database'] = 'autopulse'
 
 def create_managers_table():
-    with connect(localauth) as conn:
+    with pooled_connection(localauth) as conn:
         with conn.cursor() as cursor:
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS Managers(
@@ -31,7 +20,7 @@ def create_managers_table():
             """)
 
 def create_company_table():
-    with connect(localauth) as conn:
+    with pooled_connection(localauth) as conn:
         with conn.cursor() as cursor:
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS Companies (
@@ -41,7 +30,7 @@ def create_company_table():
             """)
 
 def create_center_table():
-    with connect(localauth) as conn:
+    with pooled_connection(localauth) as conn:
         with conn.cursor() as cursor:
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS Centers (
@@ -51,7 +40,7 @@ def create_center_table():
             """)
 
 def create_companies_centers_table():
-    with connect(localauth) as conn:
+    with pooled_connection(localauth) as conn:
         with conn.cursor() as cursor:
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS CompaniesCenters (
@@ -64,7 +53,7 @@ def create_companies_centers_table():
             """)
 
 def create_vehicle_table():
-    with connect(localauth) as conn:
+    with pooled_connection(localauth) as conn:
         with conn.cursor() as cursor:
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS Vehicles (
@@ -85,7 +74,7 @@ def create_vehicle_table():
 
 
 def create_drivers_table():
-    with connect(localauth) as conn:
+    with pooled_connection(localauth) as conn:
         with conn.cursor() as cursor:
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS Drivers (
@@ -107,7 +96,7 @@ def create_drivers_table():
             """)
 
 def create_shifts_table():
-    with connect(localauth) as conn:
+    with pooled_connection(localauth) as conn:
         with conn.cursor() as cursor:
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS Shifts (
@@ -117,7 +106,7 @@ def create_shifts_table():
             """)
 
 def create_provinces_table():
-    with connect(localauth) as conn:
+    with pooled_connection(localauth) as conn:
         with conn.cursor() as cursor:
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS Provinces (
@@ -127,7 +116,7 @@ def create_provinces_table():
             """)
 
 def create_drivers_vehicles_table():
-    with connect(localauth) as conn:
+    with pooled_connection(localauth) as conn:
         with conn.cursor() as cursor:
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS DriversVehicles (
@@ -139,15 +128,113 @@ def create_drivers_vehicles_table():
                 );
             """)
 
+def create_sync_row_hashes_table():
+    with pooled_connection(localauth) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS SyncRowHashes (
+                    table_name VARCHAR(64),
+                    row_key VARCHAR(64),
+                    row_hash CHAR(40) NOT NULL,
+                    PRIMARY KEY (table_name, row_key)
+                );
+            """)
+
+def create_sync_state_table():
+    with pooled_connection(localauth) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS SyncState (
+                    table_name VARCHAR(64) PRIMARY KEY,
+                    last_synced_at DATETIME NOT NULL,
+                    source_rows INT NOT NULL,
+                    inserted INT NOT NULL,
+                    updated INT NOT NULL,
+                    deleted INT NOT NULL,
+                    seconds DOUBLE NOT NULL
+                );
+            """)
+
+def create_sync_checkpoints_table():
+    with pooled_connection(localauth) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS SyncCheckpoints (
+                    step VARCHAR(64) PRIMARY KEY,
+                    last_key VARCHAR(255) NOT NULL,
+                    updated_at DATETIME NOT NULL
+                );
+            """)
+
+def create_driver_reach_table():
+    with pooled_connection(localauth) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS DriverReach (
+                    driver_id INT PRIMARY KEY,
+                    minutes INT NOT NULL,
+                    address_hash CHAR(40) NOT NULL,
+                    polygon LONGBLOB NOT NULL,
+                    computed_at DATETIME NOT NULL,
+                    FOREIGN KEY (driver_id) REFERENCES Drivers(kendra_id)
+                );
+            """)
+
+def create_driver_snapshot_table():
+    with pooled_connection(localauth) as conn:
+        with conn.cursor() as cursor:
+            # Denormalized read model of the driver join, rebuilt at the end of every seed run
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS DriverSnapshot (
+                    kendra_id INT PRIMARY KEY,
+                    name VARCHAR(100),
+                    street VARCHAR(255),
+                    city VARCHAR(100),
+                    country VARCHAR(100),
+                    zip_code VARCHAR(20),
+                    lat DOUBLE NOT NULL,
+                    lng DOUBLE NOT NULL,
+                    province VARCHAR(100),
+                    manager VARCHAR(50),
+                    shift VARCHAR(50),
+                    is_matched BOOLEAN NOT NULL,
+                    location POINT NOT NULL SRID 4326,
+                    address_key VARCHAR(300),
+                    refreshed_at DATETIME(6) NOT NULL,
+                    SPATIAL INDEX (location),
+                    INDEX (address_key),
+                    INDEX (refreshed_at),
+                    INDEX (shift),
+                    INDEX (manager)
+                );
+            """)
+
+# Tables in foreign-key order: each step lists the steps it depends on
+INIT_STEPS = {
+    "autopulse_db": (create_autopulse_db, []),
+    "Managers": (create_managers_table, ["autopulse_db"]),
+    "Companies": (create_company_table, ["autopulse_db"]),
+    "Centers": (create_center_table, ["autopulse_db"]),
+    "Provinces": (create_provinces_table, ["autopulse_db"]),
+    "Shifts": (create_shifts_table, ["autopulse_db"]),
+    "CompaniesCenters": (create_companies_centers_table, ["Companies", "Centers"]),
+    "Vehicles": (create_vehicle_table, ["Companies", "Centers", "Managers"]),
+    "Drivers": (create_drivers_table, ["Provinces", "Managers", "Shifts"]),
+    "DriversVehicles": (create_drivers_vehicles_table, ["Drivers", "Vehicles"]),
+    "DriverReach": (create_driver_reach_table, ["Drivers"]),
+    "DriverSnapshot": (create_driver_snapshot_table, ["autopulse_db"]),
+    "SyncRowHashes": (create_sync_row_hashes_table, ["autopulse_db"]),
+    "SyncState": (create_sync_state_table, ["autopulse_db"]),
+    "SyncCheckpoints": (create_sync_checkpoints_table, ["autopulse_db"]),
+}
+
 # Main execution block
 if __name__ == "__main__":
-    create_autopulse_db()
-    create_managers_table()
-    create_company_table()
-    create_center_table()
-    create_companies_centers_table()
-    create_vehicle_table()
-    create_provinces_table()
-    create_shifts_table()
-    create_drivers_table()
-    create_drivers_vehicles_table()
+    parser = argparse.ArgumentParser(description="Create the local autopulse schema")
+    parser.add_argument("--workers", type=int, default=4, help="steps run concurrently when independent")
+    parser.add_argument("--dry-run", action="store_true", help="print the execution plan and exit")
+    args = parser.parse_args()
+    results = run_steps(INIT_STEPS, max_workers=args.workers, dry_run=args.dry_run)
+    # Non-zero exit, so cron and CI see a failed or skipped step
+    if any(status != "ok" for status, _ in results.values()):
+        sys.exit(1)
@@ -0,0 +1,82 @@
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+def plan_waves(steps):
+    """
+    Group steps into waves: every step runs after all steps of earlier waves it depends on.
+
+    :param steps: dict of step name -> (function, list of step names it depends on)
+    :return: list of lists of step names
+    """
+    for name, (_, deps) in steps.items():
+        unknown = [dep for dep in deps if dep not in steps]
+        if unknown:
+            raise ValueError(f"Step {name} depends on unknown steps {unknown}")
+    waves = []
+    placed = set()
+    while len(placed) < len(steps):
+        wave = [name for name, (_, deps) in steps.items() if name not in placed and all(dep in placed for dep in deps)]
+        if not wave:
+            raise ValueError(f"Dependency cycle among {sorted(set(steps) - placed)}")
+        waves.append(wave)
+        placed.update(wave)
+    return waves
+
+def print_plan(steps):
+    for i, wave in enumerate(plan_waves(steps), start=1):
+        described = [f"{name} (after {', '.join(steps[name][1])})" if steps[name][1] else name for name in wave]
+        print(f"Wave {i}: {'; '.join(described)}")
+
+def run_steps(steps, max_workers=4, dry_run=False):
+    """
+    Run steps in a thread pool as soon as all their dependencies have finished.
+
+    A failed step is reported and its dependents are skipped; independent branches
+    keep running. Prints a per-step timing summary at the end.
+
+    :param steps: dict of step name -> (function, list of step names it depends on)
+    :return: dict of step name -> (status, seconds)
+    """
+    plan_waves(steps)  # Validates names and cycles before anything runs
+    if dry_run:
+        print_plan(steps)
+        return {}
+
+    results = {}
+    running = {}
+    start = perf_counter()
+
+    def timed(name, func):
+        step_start = perf_counter()
+        func()
+        return perf_counter() - step_start
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while len(results) < len(steps):
+            for name, (func, deps) in steps.items():
+                if name in results or name in running:
+                    continue
+                if any(results.get(dep, ("ok",))[0] != "ok" for dep in deps if dep in results):
+                    results[name] = ("skipped", 0.0)
+                elif all(results.get(dep, (None,))[0] == "ok" for dep in deps):
+                    running[name] = executor.submit(timed, name, func)
+            if not running:
+                continue
+            done, _ = wait(running.values(), return_when=FIRST_COMPLETED)
+            for name, future in list(running.items()):
+                if future in done:
+                    del running[name]
+                    try:
+                        results[name] = ("ok", future.result())
+                    except Exception as e:
+                        print(f"Step {name} failed: {e!r}")
+                        results[name] = ("failed", 0.0)
+
+    wall = perf_counter() - start
+    width = max(len(name) for name in steps)
+    print("Step timings:")
+    for name, (status, seconds) in results.items():
+        print(f"  {name:<{width}}  {status:<7}  {seconds:8.2f}s")
+    print(f"  {'total':<{width}}  {'':<7}  {wall:8.2f}s wall, {sum(s for _, s in results.values()):.2f}s summed")
+    return results
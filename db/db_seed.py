@@ -1,36 +1,199 @@
-from db_connect import connect, localauth, kndauth
+import os
+import sys
+import json
+import argparse
+import hashlib
+import subprocess
+import pymysql
+from time import perf_counter
+from db_connect import pooled_connection, localauth, kndauth
+from db_scheduler import run_steps
+from db_address import address_key
 
-def fetch_and_insert_shift_data(kndauth, localauth):
+# Rows per batch in streaming mode
+BATCH_SIZE = int(os.getenv("SEED_BATCH_SIZE", 5000))
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def row_hash(row):
+    """Stable fingerprint of a source row, used to detect changed rows between runs."""
+    return hashlib.sha1(repr(tuple(row)).encode()).hexdigest()
+
+def sync_incremental(localauth, table, rows, upsert_query, delete_queries=(), keys_query=None):
+    """
+    Apply only the rows that changed since the last sync of `table`.
+
+    Rows are keyed on their first column and compared by hash against SyncRowHashes.
+    New and changed rows go through `upsert_query`. When `delete_queries` are given,
+    which only Drivers does, the keys returned by `keys_query` from the target table
+    that are missing from the source are tombstoned by running each of them (formatted
+    with a `{keys}` placeholder list). Deletions come from the target table rather than
+    SyncRowHashes, so rows written by a full run, which keeps no hashes, are tombstoned
+    too. Hashes and the SyncState watermark are written in the same transaction as the data.
+
+    The whole source is read at once, so streaming, batching and resuming do not apply.
+
+    :return: dict of row counts and elapsed seconds for the report
+    """
+    start = perf_counter()
+    source = {str(row[0]): (row, row_hash(row)) for row in rows}  # last row per key wins, like the upsert
+
+    with pooled_connection(localauth) as local_conn:
+        with local_conn.cursor() as local_cursor:
+            local_cursor.execute("SELECT row_key, row_hash FROM SyncRowHashes WHERE table_name = %s;", (table,))
+            previous = dict(local_cursor.fetchall())
+
+            inserted = [key for key in source if key not in previous]
+            updated = [key for key in source if key in previous and previous[key] != source[key][1]]
+            deleted = []
+            if delete_queries:
+                local_cursor.execute(keys_query)
+                deleted = sorted({str(key) for key, in local_cursor.fetchall()} - source.keys())
+            changed = inserted + updated
+
+            if changed:
+                local_cursor.executemany(upsert_query, [source[key][0] for key in changed])
+                local_cursor.executemany(
+                    """INSERT INTO SyncRowHashes (table_name, row_key, row_hash) VALUES (%s, %s, %s)
+                    ON DUPLICATE KEY UPDATE row_hash=VALUES(row_hash);""",
+                    [(table, key, source[key][1]) for key in changed],
+                )
+            if deleted:
+                placeholders = ", ".join(["%s"] * len(deleted))
+                for delete_query in delete_queries:
+                    local_cursor.execute(delete_query.format(keys=placeholders), deleted)
+                local_cursor.execute(
+                    f"DELETE FROM SyncRowHashes WHERE table_name = %s AND row_key IN ({placeholders});", [table, *deleted]
+                )
+
+            report = {
+                "table": table,
+                "source_rows": len(source),
+                "inserted": len(inserted),
+                "updated": len(updated),
+                "deleted": len(deleted),
+                "unchanged": len(source) - len(changed),
+            }
+            report["seconds"] = perf_counter() - start
+            local_cursor.execute(
+                """INSERT INTO SyncState (table_name, last_synced_at, source_rows, inserted, updated, deleted, seconds)
+                VALUES (%s, NOW(), %s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE last_synced_at=VALUES(last_synced_at), source_rows=VALUES(source_rows),
+                inserted=VALUES(inserted), updated=VALUES(updated), deleted=VALUES(deleted), seconds=VALUES(seconds);""",
+                (table, report["source_rows"], report["inserted"], report["updated"], report["deleted"], report["seconds"]),
+            )
+        local_conn.commit()
+
+    print(f"{table}: {report['inserted']} inserted, {report['updated']} updated, {report['deleted']} deleted, "
+          f"{report['unchanged']} unchanged of {report['source_rows']} source rows in {report['seconds']:.2f}s")
+    return report
+
+def stream_batches(auth, select_query, batch_size=BATCH_SIZE):
+    """Yield the rows of `select_query` in lists of `batch_size`, read through a server-side cursor."""
+    with pooled_connection(auth) as conn:
+        with conn.cursor(pymysql.cursors.SSCursor) as cursor:
+            cursor.execute(select_query)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+
+def fetch_batches(auth, select_query, stream=False, batch_size=BATCH_SIZE):
+    """Source rows as an iterable of batches: streamed when `stream`, else one fetchall() batch."""
+    if stream:
+        return stream_batches(auth, select_query, batch_size)
+    with pooled_connection(auth) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(select_query)
+            return [cursor.fetchall()]
+
+def load_checkpoint(localauth, step):
+    """Key of the last row committed by an interrupted run of `step`, or None."""
+    with pooled_connection(localauth) as local_conn:
+        with local_conn.cursor() as local_cursor:
+            local_cursor.execute("SELECT last_key FROM SyncCheckpoints WHERE step = %s;", (step,))
+            row = local_cursor.fetchone()
+    return tuple(json.loads(row[0])) if row else None
+
+def copy_in_batches(localauth, step, batches, apply_batch, key_indexes=(0,), resume=False, sync_table=None):
+    """
+    Apply source batches to the local database, committing once per batch.
+
+    The key of the last row of each batch is checkpointed in SyncCheckpoints in the
+    same transaction as its data. With `resume`, rows whose key is not past the
+    checkpoint are skipped, which requires the source query to be ordered by the
+    key columns. The checkpoint is cleared once every batch is committed.
+
+    With `sync_table`, the SyncRowHashes of every key written are dropped in the same
+    transaction, so the next incremental run re-applies those rows instead of trusting
+    a hash taken before this full copy. Incremental runs find tombstones in the target
+    table, so dropping a hash never hides a deletion.
+
+    :param apply_batch: function(cursor, rows) writing one batch
+    :return: number of rows applied
+    """
+    checkpoint = load_checkpoint(localauth, step) if resume else None
+    if checkpoint is not None:
+        print(f"{step}: resuming after key {checkpoint}")
+    applied = 0
+    with pooled_connection(localauth) as local_conn:
+        with local_conn.cursor() as local_cursor:
+            for rows in batches:
+                if not rows:  # Empty source: fetchall() gives one empty batch
+                    continue
+                if checkpoint is not None:
+                    rows = [row for row in rows if tuple(row[i] for i in key_indexes) > checkpoint]
+                    if not rows:
+                        continue
+                    checkpoint = None  # Source is ordered, every later row is past the checkpoint
+                apply_batch(local_cursor, rows)
+                keys = sorted({str(row[0]) for row in rows})  # Keyed like sync_incremental
+                if sync_table is not None and keys:
+                    local_cursor.execute(
+                        f"DELETE FROM SyncRowHashes WHERE table_name = %s AND row_key IN ({', '.join(['%s'] * len(keys))});",
+                        [sync_table, *keys],
+                    )
+                last_key = json.dumps([rows[-1][i] for i in key_indexes], default=str)
+                local_cursor.execute(
+                    """INSERT INTO SyncCheckpoints (step, last_key, updated_at) VALUES (%s, %s, NOW())
+                    ON DUPLICATE KEY UPDATE last_key=VALUES(last_key), updated_at=VALUES(updated_at);""",
+                    (step, last_key),
+                )
+                local_conn.commit()
+                applied += len(rows)
+            local_cursor.execute("DELETE FROM SyncCheckpoints WHERE step = %s;", (step,))
+        local_conn.commit()
+    return applied
+
+def fetch_and_insert_shift_data(kndauth, localauth, incremental=False, stream=False, batch_size=BATCH_SIZE, resume=False):
     select_query = """SELECT s.id AS shift_id, s.name AS name FROM shift s ORDER BY s.id;"""
     insert_query = """INSERT IGNORE INTO Shifts (id, name) VALUES (%s, %s);"""
+    upsert_query = """INSERT INTO Shifts (id, name) VALUES (%s, %s) ON DUPLICATE KEY UPDATE name=VALUES(name);"""
 
-    with connect(kndauth) as knd_conn:
-        with knd_conn.cursor() as knd_cursor:
-            knd_cursor.execute(select_query)
-            shifts = knd_cursor.fetchall()
-    
-    with connect(localauth) as local_conn:
-        with local_conn.cursor() as local_cursor:
-            local_cursor.executemany(insert_query, shifts)
-            local_conn.commit()
-            print("Shifts data inserted successfully")
+    if incremental:
+        shifts = [row for rows in fetch_batches(kndauth, select_query) for row in rows]
+        return sync_incremental(localauth, "Shifts", shifts, upsert_query)
 
-def fetch_and_insert_provinces(kndauth, localauth):
+    batches = fetch_batches(kndauth, select_query, stream, batch_size)
+    copy_in_batches(localauth, "Shifts", batches, lambda cursor, rows: cursor.executemany(insert_query, rows),
+                    resume=resume, sync_table="Shifts")
+    print("Shifts data inserted successfully")
+
+def fetch_and_insert_provinces(kndauth, localauth, incremental=False, stream=False, batch_size=BATCH_SIZE, resume=False):
     select_query = """SELECT p.id, p.name FROM province p ORDER BY p.id;"""
     insert_query = """INSERT IGNORE INTO Provinces (id, name) VALUES (%s, %s);"""
+    upsert_query = """INSERT INTO Provinces (id, name) VALUES (%s, %s) ON DUPLICATE KEY UPDATE name=VALUES(name);"""
 
-    with connect(kndauth) as knd_conn:
-        with knd_conn.cursor() as knd_cursor:
-            knd_cursor.execute(select_query)
-            provinces = knd_cursor.fetchall()
-    
-    with connect(localauth) as local_conn:
-        with local_conn.cursor() as local_cursor:
-            local_cursor.executemany(insert_query, provinces)
-            local_conn.commit()
-            print("Provinces data inserted successfully")
+    if incremental:
+        provinces = [row for rows in fetch_batches(kndauth, select_query) for row in rows]
+        return sync_incremental(localauth, "Provinces", provinces, upsert_query)
+
+    batches = fetch_batches(kndauth, select_query, stream, batch_size)
+    copy_in_batches(localauth, "Provinces", batches, lambda cursor, rows: cursor.executemany(insert_query, rows),
+                    resume=resume, sync_table="Provinces")
+    print("Provinces data inserted successfully")
 
-def fetch_and_insert_drivers(kndauth, localauth):
+def fetch_and_insert_drivers(kndauth, localauth, incremental=False, stream=False, batch_size=BATCH_SIZE, resume=False):
     select_query = """
     SELECT
         e.id as kendra_id,
@@ -64,25 +227,32 @@ def fetch_and_insert_drivers(kndauth, localauth):
         AND es.deleted_at IS NULL
         AND a.province_id in(28)
     ORDER BY
-        e.id;"""
+        e.id, s.id;"""
     insert_query = """INSERT INTO Drivers (kendra_id, name, street, city, country, zip_code, lat, lng, province_id, manager_id, shift_id) 
     VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) 
     ON DUPLICATE KEY UPDATE 
     name=VALUES(name), street=VALUES(street), city=VALUES(city), country=VALUES(country), zip_code=VALUES(zip_code), 
     lat=VALUES(lat), lng=VALUES(lng), province_id=VALUES(province_id), manager_id=VALUES(manager_id), shift_id=VALUES(shift_id);"""
 
-    with connect(kndauth) as knd_conn:
-        with knd_conn.cursor() as knd_cursor:
-            knd_cursor.execute(select_query)
-            drivers = knd_cursor.fetchall()
-    
-    with connect(localauth) as local_conn:
-        with local_conn.cursor() as local_cursor:
-            local_cursor.executemany(insert_query, drivers)
-            local_conn.commit()
-            print("Drivers data inserted successfully")
+    # Tombstones: drop the driver's vehicle assignments and reach polygon before the driver itself
+    delete_queries = (
+        "DELETE FROM DriversVehicles WHERE driver_id IN ({keys});",
+        "DELETE FROM DriverReach WHERE driver_id IN ({keys});",
+        "DELETE FROM Drivers WHERE kendra_id IN ({keys});",
+    )
 
-def fetch_and_insert_drivers_vehicles(kndauth, localauth):
+    if incremental:
+        drivers = [row for rows in fetch_batches(kndauth, select_query) for row in rows]
+        return sync_incremental(localauth, "Drivers", drivers, insert_query, delete_queries,
+                                keys_query="SELECT DISTINCT kendra_id FROM Drivers;")
+
+    batches = fetch_batches(kndauth, select_query, stream, batch_size)
+    # A driver has one row per shift, so the resume key is (kendra_id, shift_id)
+    copy_in_batches(localauth, "Drivers", batches, lambda cursor, rows: cursor.executemany(insert_query, rows),
+                    key_indexes=(0, 10), resume=resume, sync_table="Drivers")
+    print("Drivers data inserted successfully")
+
+def fetch_and_insert_drivers_vehicles(kndauth, localauth, stream=False, batch_size=BATCH_SIZE, resume=False):
     select_query = """
     SELECT
         e.id AS driver_id,
@@ -103,34 +273,203 @@ def fetch_and_insert_drivers_vehicles(kndauth, localauth):
     ORDER BY
         e.id, v.id;
     """
+    staging_query = """INSERT IGNORE INTO DriversVehiclesStaging (driver_id, vehicle_id) VALUES (%s, %s);"""
     insert_query = """
     INSERT INTO DriversVehicles (driver_id, vehicle_id)
-    SELECT * FROM (SELECT %s AS driver_id, %s AS vehicle_id) AS tmp
-    WHERE EXISTS (
-        SELECT 1 FROM Drivers d WHERE d.kendra_id = tmp.driver_id
-    ) AND EXISTS (
-        SELECT 1 FROM Vehicles v WHERE v.kendra_id = tmp.vehicle_id
-    )
-    ON DUPLICATE KEY UPDATE driver_id=VALUES(driver_id), vehicle_id=VALUES(vehicle_id);
+    SELECT s.driver_id, s.vehicle_id
+    FROM DriversVehiclesStaging s
+        INNER JOIN Drivers d ON d.kendra_id = s.driver_id
+    WHERE EXISTS (SELECT 1 FROM Vehicles v WHERE v.kendra_id = s.vehicle_id)
+    ON DUPLICATE KEY UPDATE vehicle_id=DriversVehicles.vehicle_id;
+    """
+    rejected_query = """
+    SELECT
+        COUNT(*) AS staged,
+        COALESCE(SUM(d.kendra_id IS NULL), 0) AS missing_driver,
+        COALESCE(SUM(NOT EXISTS (SELECT 1 FROM Vehicles v WHERE v.kendra_id = s.vehicle_id)), 0) AS missing_vehicle,
+        COALESCE(SUM(d.kendra_id IS NULL OR NOT EXISTS (SELECT 1 FROM Vehicles v WHERE v.kendra_id = s.vehicle_id)), 0) AS rejected
+    FROM DriversVehiclesStaging s
+        LEFT JOIN Drivers d ON d.kendra_id = s.driver_id;
     """
 
-    with connect(kndauth) as knd_conn:
-        with knd_conn.cursor() as knd_cursor:
-            knd_cursor.execute(select_query)
-            drivers_vehicles = knd_cursor.fetchall()
-    
-    with connect(localauth) as local_conn:
-        with local_conn.cursor() as local_cursor:
-            for driver_vehicle in drivers_vehicles:
-                local_cursor.execute(insert_query, driver_vehicle)
-            local_conn.commit()
-            print("DriversVehicles data inserted successfully")
+    totals = {"staged": 0, "missing_driver": 0, "missing_vehicle": 0, "rejected": 0}
+
+    def apply_batch(local_cursor, rows):
+        local_cursor.execute("""
+            CREATE TEMPORARY TABLE IF NOT EXISTS DriversVehiclesStaging (
+                driver_id INT,
+                vehicle_id INT,
+                PRIMARY KEY (driver_id, vehicle_id)
+            );
+        """)
+        # DELETE rather than TRUNCATE, so emptying the staging table stays inside the batch transaction
+        local_cursor.execute("DELETE FROM DriversVehiclesStaging;")
+        # pymysql rewrites executemany of a plain INSERT ... VALUES into multi-row inserts
+        local_cursor.executemany(staging_query, rows)
+        local_cursor.execute(rejected_query)
+        for key, value in zip(("staged", "missing_driver", "missing_vehicle", "rejected"), local_cursor.fetchone()):
+            totals[key] += int(value)
+        local_cursor.execute(insert_query)
+
+    start = perf_counter()
+    batches = fetch_batches(kndauth, select_query, stream, batch_size)
+    copy_in_batches(localauth, "DriversVehicles", batches, apply_batch, key_indexes=(0, 1), resume=resume)
+    print(f"DriversVehicles data inserted successfully: {totals['staged'] - totals['rejected']} of "
+          f"{totals['staged']} pairs loaded, {totals['rejected']} rejected ({totals['missing_driver']} missing driver, "
+          f"{totals['missing_vehicle']} missing vehicle) in {perf_counter() - start:.2f}s")
+
+# Columns of DriverSnapshot compared between runs; location is derived from lat and lng
+SNAPSHOT_COLUMNS = ("name", "street", "city", "country", "zip_code", "lat", "lng",
+                    "province", "manager", "shift", "is_matched", "address_key")
+
+def refresh_driver_snapshot(localauth):
+    """
+    Bring the DriverSnapshot read model up to date with Drivers and its dimension and assignment tables.
+
+    The new snapshot is built in a temporary table, which is not written to the binlog,
+    and only its differences are applied: drivers gone are deleted, changed rows are
+    updated and new ones inserted, each stamped with refreshed_at. An unchanged night
+    writes nothing. Runs in one transaction, so readers keep seeing the previous
+    snapshot until it commits. Drivers without valid coordinates have no location and
+    are left out, and counted. Each home address gets its normalized address_key, so
+    the app geocodes drivers' addresses with one indexed lookup.
+    """
+    start = perf_counter()
+    columns = ", ".join(SNAPSHOT_COLUMNS)
+    changed = " OR ".join(f"NOT (S.{column} <=> N.{column})" for column in SNAPSHOT_COLUMNS)
+    with pooled_connection(localauth) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("DROP TEMPORARY TABLE IF EXISTS DriverSnapshotStaging;")
+            cursor.execute("""
+                CREATE TEMPORARY TABLE DriverSnapshotStaging (
+                    kendra_id INT PRIMARY KEY,
+                    name VARCHAR(100),
+                    street VARCHAR(255),
+                    city VARCHAR(100),
+                    country VARCHAR(100),
+                    zip_code VARCHAR(20),
+                    lat DOUBLE NOT NULL,
+                    lng DOUBLE NOT NULL,
+                    province VARCHAR(100),
+                    manager VARCHAR(50),
+                    shift VARCHAR(50),
+                    is_matched BOOLEAN NOT NULL,
+                    address_key VARCHAR(300)
+                );
+            """)
+            cursor.execute("""
+                SELECT
+                    D.kendra_id,
+                    D.name,
+                    D.street,
+                    D.city,
+                    D.country,
+                    D.zip_code,
+                    D.lat,
+                    D.lng,
+                    P.name,
+                    M.name,
+                    S.name,
+                    EXISTS (SELECT 1 FROM DriversVehicles DV WHERE DV.driver_id = D.kendra_id)
+                FROM
+                    Drivers D
+                    LEFT JOIN Provinces P ON D.province_id = P.id
+                    LEFT JOIN Managers M ON D.manager_id = M.id
+                    LEFT JOIN Shifts S ON D.shift_id = S.id
+                WHERE
+                    D.lat BETWEEN -90 AND 90
+                    AND D.lng BETWEEN -180 AND 180;
+            """)
+            # The key is normalized in Python (accents, abbreviations), so rows go through Python once
+            staged = [(*row, address_key(row[2], row[5]) if row[2] is not None else None) for row in cursor.fetchall()]
+            rows = len(staged)
+            # pymysql rewrites executemany of a plain INSERT ... VALUES into multi-row inserts
+            cursor.executemany(
+                f"INSERT INTO DriverSnapshotStaging (kendra_id, {columns}) VALUES ({', '.join(['%s'] * (len(SNAPSHOT_COLUMNS) + 1))});",
+                staged,
+            )
+
+            cursor.execute("""
+                DELETE S FROM DriverSnapshot S
+                    LEFT JOIN DriverSnapshotStaging N ON N.kendra_id = S.kendra_id
+                WHERE N.kendra_id IS NULL;
+            """)
+            deleted = cursor.rowcount
+            cursor.execute(f"""
+                UPDATE DriverSnapshot S
+                    INNER JOIN DriverSnapshotStaging N ON N.kendra_id = S.kendra_id
+                SET {", ".join(f"S.{column} = N.{column}" for column in SNAPSHOT_COLUMNS)},
+                    S.location = ST_SRID(POINT(N.lng, N.lat), 4326),
+                    S.refreshed_at = NOW(6)
+                WHERE {changed};
+            """)
+            updated = cursor.rowcount
+            cursor.execute(f"""
+                INSERT INTO DriverSnapshot (kendra_id, {columns}, location, refreshed_at)
+                SELECT N.kendra_id, {", ".join(f"N.{column}" for column in SNAPSHOT_COLUMNS)},
+                    ST_SRID(POINT(N.lng, N.lat), 4326), NOW(6)
+                FROM DriverSnapshotStaging N
+                    LEFT JOIN DriverSnapshot S ON S.kendra_id = N.kendra_id
+                WHERE S.kendra_id IS NULL;
+            """)
+            inserted = cursor.rowcount
+            cursor.execute("DROP TEMPORARY TABLE DriverSnapshotStaging;")
+            cursor.execute("SELECT COUNT(*) FROM Drivers;")
+            dropped = cursor.fetchone()[0] - rows
+        conn.commit()
+    print(f"DriverSnapshot refreshed: {rows} drivers ({inserted} inserted, {updated} updated, {deleted} deleted), "
+          f"{dropped} dropped for missing or out-of-range coordinates, in {perf_counter() - start:.2f}s")
+
+def refresh_driver_reach(minutes=None):
+    """
+    Recompute the reach polygons of drivers whose address changed by running utils/driver_reach.py.
+
+    It runs as its own process from the repository root, where utils/ and db/ are packages,
+    so this script never imports the app modules and needs no GraphHopper or Mapbox
+    settings unless the step is requested.
+    """
+    command = [sys.executable, "-m", "utils.driver_reach"]
+    if minutes:
+        command += ["--minutes", str(minutes)]
+    subprocess.run(command, cwd=REPO_ROOT, check=True)
 
 if __name__ == "__main__":
-    fetch_and_insert_shift_data(kndauth, localauth)
-    fetch_and_insert_provinces(kndauth, localauth)
-    fetch_and_insert_drivers(kndauth, localauth)
-    fetch_and_insert_drivers_vehicles(kndauth, localauth)
+    parser = argparse.ArgumentParser(description="Seed the local autopulse database from Kendra")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only write rows that changed since the last run (Shifts, Provinces, Drivers; only Drivers "
+                             "deletes rows gone from the source). Reads each source in one go, so --stream, "
+                             "--batch-size and --resume only apply to DriversVehicles")
+    parser.add_argument("--stream", action="store_true",
+                        help="read the source through a server-side cursor and commit every --batch-size rows")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--resume", action="store_true",
+                        help="skip rows already committed by an interrupted run")
+    parser.add_argument("--workers", type=int, default=4, help="steps run concurrently when independent")
+    parser.add_argument("--dry-run", action="store_true", help="print the execution plan and exit")
+    parser.add_argument("--with-reach", action="store_true",
+                        help="also recompute per-driver reach polygons (needs GraphHopper and the app's environment)")
+    parser.add_argument("--reach-minutes", type=int, help="minutes of the per-driver reach polygons")
+    args = parser.parse_args()
+    batching = dict(stream=args.stream, batch_size=args.batch_size, resume=args.resume)
+    if args.incremental and (args.stream or args.resume):
+        print("--incremental reads Shifts, Provinces and Drivers in one go; --stream and --resume only apply to DriversVehicles")
+
+    # Shifts and Provinces are independent; Drivers references both, DriversVehicles and DriverReach reference Drivers
+    seed_steps = {
+        "Shifts": (lambda: fetch_and_insert_shift_data(kndauth, localauth, incremental=args.incremental, **batching), []),
+        "Provinces": (lambda: fetch_and_insert_provinces(kndauth, localauth, incremental=args.incremental, **batching), []),
+        "Drivers": (lambda: fetch_and_insert_drivers(kndauth, localauth, incremental=args.incremental, **batching),
+                    ["Shifts", "Provinces"]),
+        "DriversVehicles": (lambda: fetch_and_insert_drivers_vehicles(kndauth, localauth, **batching), ["Drivers"]),
+        # The read model is rebuilt last, from everything the steps above wrote
+        "DriverSnapshot": (lambda: refresh_driver_snapshot(localauth), ["Drivers", "DriversVehicles"]),
+    }
+    if args.with_reach:
+        seed_steps["DriverReach"] = (lambda: refresh_driver_reach(args.reach_minutes), ["Drivers"])
+    results = run_steps(seed_steps, max_workers=args.workers, dry_run=args.dry_run)
+    # Non-zero exit, so cron and CI see a failed or skipped step
+    if any(status != "ok" for status, _ in results.values()):
+        sys.exit(1)
 
 # def fetch_and_insert_vehicles(kndauth, localauth):
 #     all_ids = companies['all']
@@ -159,12 +498,12 @@ if __name__ == "__main__":
 #     plate=VALUES(plate), status=VALUES(status), manager_id=VALUES(manager_id), manager=VALUES(manager), company_id=VALUES(company_id), 
 #     company=VALUES(company), center_id=VALUES(center_id), center=VALUES(center);"""
 
-#     with connect(kndauth) as knd_conn:
+#     with pooled_connection(kndauth) as knd_conn:
 #         with knd_conn.cursor() as knd_cursor:
 #             knd_cursor.execute(select_query)
 #             vehicles = knd_cursor.fetchall()
     
-#     with connect(localauth) as local_conn:
+#     with pooled_connection(localauth) as local_conn:
 #         with local_conn.cursor() as local_cursor:
 #             local_cursor.executemany(insert_query, vehicles)
 #             local_conn.commit()
@@ -1,30 +1,159 @@
+import os
+import time
+import threading
 import pandas as pd
-from .db_connect import connect, localauth
+from .db_connect import pooled_connection, localauth
+from .db_address import address_key
+from utils.metrics import timed, record_rows
+from utils.cache_utils import TTLCache, cache_path, file_lease
 import json
 
 import pandas as pd
 import geopandas as gpd
 
+# "snapshot" reads drivers from the DriverSnapshot read model that db_seed rebuilds, "join" joins the seeded tables
+DRIVER_READ_MODEL = os.getenv("DRIVER_READ_MODEL", "snapshot")
+DRIVER_QUERIES = {
+    "snapshot": """
+        SELECT
+            kendra_id, name, street, city, country, zip_code, lat, lng, province, manager, shift, is_matched
+        FROM
+            DriverSnapshot;""",
+    "join": """
+        SELECT
+            D.kendra_id,
+            D.name AS name,
+            D.street,
+            D.city,
+            D.country,
+            D.zip_code,
+            D.lat,
+            D.lng,
+            P.name AS province,
+            M.name AS manager,
+            S.name AS shift,
+            MAX(CASE WHEN DV.driver_id IS NOT NULL THEN TRUE ELSE FALSE END) AS is_matched
+        FROM
+            Drivers D
+            LEFT JOIN Provinces P ON D.province_id = P.id
+            LEFT JOIN Managers M ON D.manager_id = M.id
+            LEFT JOIN Shifts S ON D.shift_id = S.id
+            LEFT JOIN DriversVehicles DV ON D.kendra_id = DV.driver_id
+        GROUP BY
+            D.kendra_id, D.name, D.street, D.city, D.country, D.zip_code, D.lat, D.lng, P.name, M.name, S.name;""",
+}
+# Version of the rows fetch_drivers reads; the snapshot is reloaded when it changes.
+# A DriverSnapshot refresh stamps refreshed_at on every row it inserts or updates, so its
+# indexed maximum moves with any change; deleted drivers show in the row count instead.
+# The join tables carry no timestamp, so that fallback pays for a full CHECKSUM TABLE per probe.
+DRIVER_VERSION_QUERIES = {
+    "snapshot": "SELECT MAX(refreshed_at), COUNT(*) FROM DriverSnapshot;",
+    "join": "CHECKSUM TABLE Drivers, DriversVehicles, Managers, Shifts, Provinces;",
+}
+# Minimum seconds between two version probes of the driver tables
+DRIVER_SNAPSHOT_PROBE_INTERVAL = float(os.getenv("DRIVER_SNAPSHOT_PROBE_INTERVAL", 30))
+
+# Seconds after which the cached dimension tables are fetched again
+DIMENSION_REFRESH_SECONDS = float(os.getenv("DIMENSION_REFRESH_SECONDS", 300))
+# Disk only, so every worker reads the copy written by the last refresh, whichever worker made it
+DIMENSION_CACHE = TTLCache(
+    maxsize=0,
+    ttl=int(os.getenv("DIMENSION_CACHE_TTL", 7 * 24 * 60 * 60)),
+    path=os.getenv("DIMENSION_CACHE_PATH", cache_path("dimensions.sqlite")),
+    disk_maxsize=8,
+)
+
+_driver_snapshot_lock = threading.Lock()
+
+def _after_fork_in_child():
+    # A forked background job keeps the parent's snapshot, but not a lock another parent thread held
+    global _driver_snapshot_lock
+    _driver_snapshot_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+_driver_snapshot = {
+    "data": None,
+    "version": None,
+    "loaded_at": None,
+    "probed_at": None,
+    "load_seconds": None,
+    "refreshes": 0,
+    "rows": 0,
+    "memory_bytes": 0,
+}
+
+@timed("db.fetch_managers")
 def fetch_managers():
-    with connect(localauth) as local_conn:
+    with pooled_connection(localauth) as local_conn:
         with local_conn.cursor() as local_cursor:
             local_cursor.execute("""SELECT id, name FROM Managers;""")
             managers = local_cursor.fetchall()
             columns = [desc[0] for desc in local_cursor.description]
             managers = pd.DataFrame(managers, columns=columns)
+    record_rows("db.fetch_managers", len(managers))
     return managers
 
+@timed("db.fetch_shifts")
 def fetch_shifts():
-    with connect(localauth) as local_conn:
+    with pooled_connection(localauth) as local_conn:
         with local_conn.cursor() as local_cursor:
             local_cursor.execute("""SELECT id, name FROM Shifts;""")
             shifts = local_cursor.fetchall()
             columns = [desc[0] for desc in local_cursor.description]
             shifts = pd.DataFrame(shifts, columns=columns)
+    record_rows("db.fetch_shifts", len(shifts))
     return shifts
 
+@timed("db.fetch_provinces")
+def fetch_provinces():
+    with pooled_connection(localauth) as local_conn:
+        with local_conn.cursor() as local_cursor:
+            local_cursor.execute("""SELECT id, name FROM Provinces;""")
+            provinces = local_cursor.fetchall()
+            columns = [desc[0] for desc in local_cursor.description]
+            provinces = pd.DataFrame(provinces, columns=columns)
+    record_rows("db.fetch_provinces", len(provinces))
+    return provinces
+
+def cached_dimensions():
+    """Last fetched dimension tables, read from the shared cache without touching MySQL; None if never fetched."""
+    return DIMENSION_CACHE.get("dimensions")
+
+@timed("db.get_dimensions")
+def get_dimensions():
+    """
+    Shifts, managers and provinces as lists of {id, name} records, shared by all workers.
+
+    The copy in DIMENSION_CACHE is refetched once it is older than DIMENSION_REFRESH_SECONDS.
+    Only the worker holding the refresh lease queries MySQL; the others keep returning
+    the previous copy meanwhile, which is None until the first fetch completes.
+    """
+    dimensions = cached_dimensions()
+    if dimensions is not None and time.time() - dimensions["fetched_at"] < DIMENSION_REFRESH_SECONDS:
+        return dimensions
+    with file_lease("dimensions.lease", stale_after=120) as acquired:
+        if not acquired:
+            return dimensions
+        # Another worker may have refreshed between our read and taking the lease
+        latest = cached_dimensions()
+        if latest is not None and time.time() - latest["fetched_at"] < DIMENSION_REFRESH_SECONDS:
+            return latest
+        dimensions = {
+            "fetched_at": time.time(),
+            "shifts": fetch_shifts().to_dict("records"),
+            "managers": fetch_managers().to_dict("records"),
+            "provinces": fetch_provinces().to_dict("records"),
+        }
+        DIMENSION_CACHE.set("dimensions", dimensions)
+    print(f"Dimension tables refreshed: {len(dimensions['shifts'])} shifts, {len(dimensions['managers'])} managers, "
+          f"{len(dimensions['provinces'])} provinces")
+    return dimensions
+
+@timed("db.fetch_drivers_geojson")
 def fetch_drivers_geojson():
-    with connect(localauth) as local_conn:
+    with pooled_connection(localauth) as local_conn:
         with local_conn.cursor() as local_cursor:
             local_cursor.execute("""SELECT
                                     D.kendra_id,
@@ -46,55 +175,137 @@ def fetch_drivers_geojson():
             drivers = local_cursor.fetchall()
             columns = [desc[0] for desc in local_cursor.description]
             drivers = pd.DataFrame(drivers, columns=columns)
+            record_rows("db.fetch_drivers_geojson", len(drivers))
             drivers = gpd.GeoDataFrame(drivers, geometry=gpd.points_from_xy(drivers.lng, drivers.lat)).set_crs(4326)
             drivers = drivers.drop(columns=['lat', 'lng'])
             drivers = json.loads(drivers.to_json())
     return drivers
 
+@timed("db.fetch_drivers")
 def fetch_drivers():
-    with connect(localauth) as local_conn:
+    with pooled_connection(localauth) as local_conn:
         with local_conn.cursor() as local_cursor:
-            local_cursor.execute("""SELECT
-                                        D.kendra_id,
-                                        D.name AS name,
-                                        D.street,
-                                        D.city,
-                                        D.country,
-                                        D.zip_code,
-                                        D.lat,
-                                        D.lng,
-                                        P.name AS province,
-                                        M.name AS manager,
-                                        S.name AS shift,
-                                        MAX(CASE WHEN DV.driver_id IS NOT NULL THEN TRUE ELSE FALSE END) AS is_matched
-                                    FROM
-                                        Drivers D
-                                        LEFT JOIN Provinces P ON D.province_id = P.id
-                                        LEFT JOIN Managers M ON D.manager_id = M.id
-                                        LEFT JOIN Shifts S ON D.shift_id = S.id
-                                        LEFT JOIN DriversVehicles DV ON D.kendra_id = DV.driver_id
-                                    GROUP BY
-                                        D.kendra_id, D.name, D.street, D.city, D.country, D.zip_code, D.lat, D.lng, P.name, M.name, S.name;""")
+            local_cursor.execute(DRIVER_QUERIES[DRIVER_READ_MODEL])
             drivers = local_cursor.fetchall()
             columns = [desc[0] for desc in local_cursor.description]
             drivers_df = pd.DataFrame(drivers, columns=columns)
-            # Convert DataFrame to GeoDataFrame
-            drivers_gdf = gpd.GeoDataFrame(drivers_df, geometry=gpd.points_from_xy(drivers_df.lng, drivers_df.lat))
-            drivers_gdf.set_crs(epsg=4326, inplace=True)
-            # Convert to a list of dictionaries suitable for ScatterplotLayer
-            drivers_list_dict = [
-                {
-                    "coordinates": [driver.geometry.x, driver.geometry.y],
-                    "color": [255, 0, 0, 255],  # Example color: red
-                    "radius": 50,  # Example radius
-                    "name": driver["name"],
-                    "street": driver["street"],
-                    "manager": driver["manager"],
-                    "shift": driver["shift"]
-                } for index, driver in drivers_gdf.iterrows()
-            ]
-            
-    return drivers_df, drivers_gdf, drivers_list_dict
+            record_rows("db.fetch_drivers", len(drivers_df))
+    return drivers_frames(drivers_df)
+
+@timed("db.drivers_frames")
+def drivers_frames(drivers_df):
+    """
+    GeoDataFrame of the drivers returned by the driver query.
+
+    :return: (drivers_df, drivers_gdf)
+    """
+    # Convert DataFrame to GeoDataFrame
+    drivers_gdf = gpd.GeoDataFrame(drivers_df, geometry=gpd.points_from_xy(drivers_df.lng, drivers_df.lat))
+    drivers_gdf.set_crs(epsg=4326, inplace=True)
+    return drivers_df, drivers_gdf
+
+@timed("db.fetch_drivers_version")
+def fetch_drivers_version():
+    """Version of the driver rows: the last DriverSnapshot rebuild, or checksums of the join tables."""
+    with pooled_connection(localauth) as local_conn:
+        with local_conn.cursor() as local_cursor:
+            local_cursor.execute(DRIVER_VERSION_QUERIES[DRIVER_READ_MODEL])
+            return tuple(local_cursor.fetchall())
+
+@timed("db.lookup_driver_address")
+def lookup_driver_address(street, postal_code):
+    """Coordinates (lat, lon) of a driver's home at this address, by the indexed DriverSnapshot.address_key, or None."""
+    with pooled_connection(localauth) as local_conn:
+        with local_conn.cursor() as local_cursor:
+            local_cursor.execute("SELECT lat, lng FROM DriverSnapshot WHERE address_key = %s LIMIT 1;",
+                                 (address_key(street, postal_code),))
+            row = local_cursor.fetchone()
+    return (float(row[0]), float(row[1])) if row else None
+
+@timed("db.fetch_candidate_drivers")
+def fetch_candidate_drivers(area_wkt, shifts=None, managers=None, exact=False):
+    """
+    Drivers inside an area that match the shift and manager filters, read from DriverSnapshot.
+
+    The area is pushed into the query as a parameter: by its bounding rectangle
+    (MBRContains), or with exact=True by its geometry (ST_Contains). Both can use the
+    spatial index on DriverSnapshot.location. Drivers outside the area are counted as
+    all drivers matching the filters, which can use the shift and manager indexes,
+    minus the candidates; a NOT over the area could not use the spatial index.
+
+    :param area_wkt: Polygon WKT in lon/lat order
+    :return: (drivers_df, drivers_gdf, number of drivers matching the filters outside the area)
+    """
+    contains = "ST_Contains" if exact else "MBRContains"
+    area = "ST_GeomFromText(%s, 4326, 'axis-order=long-lat')"
+    filters, params = [], []
+    for column, values in (("shift", shifts), ("manager", managers)):
+        if values:
+            filters.append(f"{column} IN ({', '.join(['%s'] * len(values))})")
+            params.extend(values)
+    where = "".join(f" AND {condition}" for condition in filters)
+    with pooled_connection(localauth) as local_conn:
+        with local_conn.cursor() as local_cursor:
+            local_cursor.execute(f"""
+                SELECT
+                    kendra_id, name, street, city, country, zip_code, lat, lng, province, manager, shift, is_matched
+                FROM
+                    DriverSnapshot
+                WHERE
+                    {contains}({area}, location){where};""", [area_wkt] + params)
+            drivers = local_cursor.fetchall()
+            columns = [desc[0] for desc in local_cursor.description]
+            local_cursor.execute(f"""
+                SELECT COUNT(*)
+                FROM DriverSnapshot
+                WHERE TRUE{where};""", params)
+            outside = int(local_cursor.fetchone()[0]) - len(drivers)
+    drivers_df = pd.DataFrame(drivers, columns=columns)
+    record_rows("db.fetch_candidate_drivers", len(drivers_df))
+    drivers_df, drivers_gdf = drivers_frames(drivers_df)
+    return drivers_df, drivers_gdf, outside
+
+@timed("db.get_driver_snapshot")
+def get_driver_snapshot(force=False):
+    """
+    Process-level snapshot of fetch_drivers().
+
+    The driver tables are probed at most every DRIVER_SNAPSHOT_PROBE_INTERVAL seconds
+    and the snapshot is only reloaded when their version changed. Callers must treat
+    the returned frames as read-only and filter into new objects.
+
+    :return: (drivers_df, drivers_gdf), as returned by fetch_drivers()
+    """
+    with _driver_snapshot_lock:
+        now = time.time()
+        probed_at = _driver_snapshot["probed_at"]
+        if not force and _driver_snapshot["data"] is not None and now - probed_at < DRIVER_SNAPSHOT_PROBE_INTERVAL:
+            return _driver_snapshot["data"]
+
+        version = fetch_drivers_version()
+        _driver_snapshot["probed_at"] = now
+        if force or _driver_snapshot["data"] is None or version != _driver_snapshot["version"]:
+            start = time.perf_counter()
+            data = fetch_drivers()
+            drivers_df, _ = data
+            _driver_snapshot.update(
+                data=data,
+                version=version,
+                loaded_at=now,
+                load_seconds=time.perf_counter() - start,
+                refreshes=_driver_snapshot["refreshes"] + 1,
+                rows=len(drivers_df),
+                # Every frame the snapshot holds; the GeoDataFrame is a copy, not a view of drivers_df
+                memory_bytes=sum(int(frame.memory_usage(deep=True).sum()) for frame in data),
+            )
+            print(f"Driver snapshot refreshed: {_driver_snapshot['rows']} drivers, "
+                  f"{_driver_snapshot['memory_bytes'] / 2**20:.1f} MiB, {_driver_snapshot['load_seconds']:.2f}s")
+        return _driver_snapshot["data"]
+
+def driver_snapshot_info():
+    """Refresh counters, row count and memory footprint of the driver snapshot."""
+    with _driver_snapshot_lock:
+        return {key: value for key, value in _driver_snapshot.items() if key != "data"}
 
 # def fetch_drivers():
 #     query = """
@@ -115,7 +326,7 @@ def fetch_drivers():
 #     LEFT JOIN Managers M ON D.manager_id = M.id
 #     LEFT JOIN Shifts S ON D.shift_id = S.id;
 #     """
-#     with connect(localauth) as local_conn:
+#     with pooled_connection(localauth) as local_conn:
 #         with local_conn.cursor() as local_cursor:
 #             local_cursor.execute(query)
 #             drivers = local_cursor.fetchall()
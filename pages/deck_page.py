@@ -1,15 +1,24 @@
 import os
+import uuid
+import numpy as np
+import pandas as pd
 import dash
 from dash_deck import DeckGL
-from dash import html, callback, ALL
+from dash import html, callback, ctx, Patch
 import pydeck as pdk
-from utils.geo_utils import geoencode_address, calculate_isochrones, partition_drivers_by_isochrones, extract_coords_from_encompassing_isochrone, check_partitions_intersection
-from db.db_support import fetch_drivers, fetch_shifts, fetch_managers
+from utils.geo_utils import get_address_index, geoencode_address, calculate_isochrones, simplify_isochrones, label_drivers_by_isochrones, partitions_from_labels, extract_coords_from_encompassing_isochrone, encompassing_area_wkt, check_partitions_intersection, RENDER_SIMPLIFY_TOLERANCE, CONTAINMENT_SIMPLIFY_TOLERANCE
+from utils.cache_utils import TTLCache, cache_path
+from utils.grid_index import get_grid_index
+from utils.deck_utils import build_drivers_layer, deck_data, layer_data, DRIVER_TOOLTIP, MAP_UPDATE_MODE, DRIVERS_LAYER_INDEX
+from utils.table_utils import cache_partitions, build_partition_tables, page_partition, PAGE_SIZE
+from utils.background_utils import job_slot, BACKGROUND_CALLBACKS, BACKGROUND_MANAGER
+from utils.metrics import timed, trace, record_rows, flush as flush_metrics
+from db.db_support import get_driver_snapshot, fetch_candidate_drivers, get_dimensions, cached_dimensions, DIMENSION_REFRESH_SECONDS
 from dash.dependencies import Input, Output, State
 from dash import dcc
-from dash import dash_table, dcc, html
+from dash import dcc, html
 import dash_bootstrap_components as dbc
-from dash.dependencies import ALL
+from dash.dependencies import MATCH
 
 dash.register_page(__name__, path='/')
 
@@ -20,199 +29,348 @@ MAPBOX_API_KEY = os.getenv("MAPBOX_TOKEN")
 MAP_STYLES = ["mapbox://styles/mapbox/light-v9", "mapbox://styles/mapbox/dark-v9", "mapbox://styles/mapbox/satellite-v9"]
 CHOSEN_STYLE = MAP_STYLES[0]
 
-layout = html.Div([
-    # Container for inputs and button
-    html.Div([
-        dcc.Input(id='street-input', type='text', placeholder='Enter street name and number', required=True, style={'marginRight': '10px', 'width': '350px', 'display': 'block', 'marginBottom': '10px'}),
-        html.Div([  # Div to wrap zip-code-input and Submit button
-            dcc.Input(id='zip-code-input', type='text', placeholder='Enter zip code', name='Zip code', required=False, style={'marginRight': '10px', 'display': 'inline-block', 'marginBottom': '10px'}),
-            html.Button('Submit', id='submit-val', n_clicks=0, style={'display': 'inline-block'}),
-        ], style={'display': 'flex', 'flexDirection': 'row'}),
-        html.Label('Isochrone Limits (in minutes):', style={'display': 'block', 'marginBottom': '10px'}),
-        dcc.RangeSlider(
-            id='time-limit-range-slider',
-            min=5,
-            max=60,
-            step=5,
-            value=[5, 10],
-            marks={i: f'{i}' for i in range(5, 61, 5)},
-        ),
-        dcc.Dropdown(
-            id='shifts-dropdown',
-            options=[{'label': shift['name'], 'value': shift['name']} for shift in fetch_shifts().to_dict('records')],
-            placeholder='Select a shift',
-            multi=True,
-            style={'marginBottom': '10px'}
-        ),
-        dcc.Dropdown(  # Dropdown for managers
-            id='managers-dropdown',
-            options=[{'label': manager['name'], 'value': manager['name']} for manager in fetch_managers().to_dict('records')],
-            placeholder='Select a manager',
-            multi=True,
-            style={'marginBottom': '10px'}
-        ),
-    ], style={'padding': '20px', 'maxWidth': '600px'}),
+# Answer searches from the precomputed isochrone grid when one has been built (see utils/grid_index.py)
+GRID_INDEX_ENABLED = os.getenv("GRID_INDEX_ENABLED", "1") == "1"
+
+# "memory" labels the whole in-process driver snapshot, "pushdown" asks MySQL for the candidate drivers only
+DRIVER_QUERY_MODE = os.getenv("DRIVER_QUERY_MODE", "memory")
+# Area pushed into the query in pushdown mode: the outermost ring's bounding "bbox" or its "polygon"
+PUSHDOWN_AREA = os.getenv("PUSHDOWN_AREA", "bbox")
+
+# Seconds between attempts to load the dropdown options while none have been fetched
+DIMENSION_RETRY_SECONDS = 5
+
+# Texts of the search alert
+GEOCODE_FAILED_MESSAGE = "Unable to find location. Please check the address and zip code, then try again."
+ROUTING_UNAVAILABLE_MESSAGE = "Routing is unavailable right now, so the isochrones could not be computed. Please try again in a minute."
+
+# Geocode, isochrones and per-driver ring labels of each Submit, shared by all workers
+SEARCH_CACHE = TTLCache(
+    maxsize=int(os.getenv("SEARCH_CACHE_SIZE", 32)),
+    ttl=int(os.getenv("SEARCH_CACHE_TTL", 60 * 60)),
+    path=os.getenv("SEARCH_CACHE_PATH", cache_path("searches.sqlite")) or None,
+)
+
+def dimension_options(dimensions, table):
+    """Dropdown options of a cached dimension table, empty until it has been fetched."""
+    if dimensions is None:
+        return []
+    return [{'label': row['name'], 'value': row['name']} for row in dimensions[table]]
+
+def layout(**kwargs):
+    """Page layout, built per page load from whatever dimension tables are cached; never queries MySQL."""
+    dimensions = cached_dimensions()
+    return html.Div([
+        # Container for inputs and button
+        html.Div([
+            dcc.Input(id='street-input', type='text', placeholder='Enter street name and number', required=True, style={'marginRight': '10px', 'width': '350px', 'display': 'block', 'marginBottom': '10px'}),
+            html.Div([  # Div to wrap zip-code-input and Submit button
+                dcc.Input(id='zip-code-input', type='text', placeholder='Enter zip code', name='Zip code', required=False, style={'marginRight': '10px', 'display': 'inline-block', 'marginBottom': '10px'}),
+                html.Button('Submit', id='submit-val', n_clicks=0, style={'display': 'inline-block'}),
+                html.Button('Cancel', id='cancel-search', n_clicks=0, style={'display': 'none', 'marginLeft': '10px'}),
+            ], style={'display': 'flex', 'flexDirection': 'row'}),
+            html.Div(  # Stage of the running search, shown while it runs in the background
+                id='search-progress-container',
+                children=[dbc.Progress(id='search-progress', value=0, label='', style={'height': '20px'})],
+                style={'display': 'none'}
+            ),
+            html.Label('Isochrone Limits (in minutes):', style={'display': 'block', 'marginBottom': '10px'}),
+            dcc.RangeSlider(
+                id='time-limit-range-slider',
+                min=5,
+                max=60,
+                step=5,
+                value=[5, 10],
+                marks={i: f'{i}' for i in range(5, 61, 5)},
+            ),
+            dcc.Checklist(  # Skip the precomputed grid and ask GraphHopper for exact isochrones
+                id='live-routing-checklist',
+                options=[{'label': ' Refine with live routing', 'value': 'live'}],
+                value=[],
+                style={'marginBottom': '10px'}
+            ),
+            dcc.Dropdown(
+                id='shifts-dropdown',
+                options=dimension_options(dimensions, 'shifts'),
+                placeholder='Select a shift',
+                multi=True,
+                style={'marginBottom': '10px'}
+            ),
+            dcc.Dropdown(  # Dropdown for managers
+                id='managers-dropdown',
+                options=dimension_options(dimensions, 'managers'),
+                placeholder='Select a manager',
+                multi=True,
+                style={'marginBottom': '10px'}
+            ),
+        ], style={'padding': '20px', 'maxWidth': '600px'}),
     
-    # Alert for failed geoencoding
-    dbc.Alert(
-        id="alert-fail-geoencode",
-        children="Unable to find location. Please check the address and zip code, then try again.",
-        color="danger",
-        dismissable=True,  # Allows the user to close the alert
-        is_open=False,  # Initially hidden
-        style={'marginTop': '20px'},  # Adjust the margin as needed
-        ),
-
-    # Container for the map
-    html.Div([
-        dcc.Loading(
-            id="loading-map", 
-            children=[
-                html.Div(
-                    DeckGL(
-                        id="map",
-                        data=pdk.Deck(
-                            initial_view_state=pdk.ViewState(
-                                longitude=ATOCHA[0],
-                                latitude=ATOCHA[1],
-                                zoom=5,
-                                pitch=0,
-                            ),
-                            layers=[],
-                            map_style=CHOSEN_STYLE,                            
-                        ).to_json(),
-                        mapboxKey=MAPBOX_API_KEY,
-                        tooltip={
-                            "html": "<b>Name:</b> {name}<br><b>Street:</b> {street}<br><b>Manager:</b> {manager}<br><b>Shift:</b> {shift}",
-                            "style": {
-                                "backgroundColor": "steelblue",
-                                "color": "white"
-                            }
-                        }
-                    ),
-                    style={'height': '50vh', 'width': '100%'}  # Set the size of the map here
-                )
-            ], 
-            type="circle"
-        ),
-    ], style={'width': '80%', 'position': 'relative', 'marginTop': '20px'}),  # Adjust marginTop as needed
-    html.Div(id='data-tables-container', children=[]),  # Container for dynamic data tables
-    # html.Button('Create Match', id='create-match', n_clicks=0, style={'marginTop': '20px', 'marginBottom': '20px'}),  # Button for creating matches
-    # dcc.Store(id='drivers-to-match-store'),  # Store for selected drivers' IDs
-], style={'display': 'flex', 'flexDirection': 'column', 'alignItems': 'center'})  # This ensures vertical stacking and center alignment
+        # Alert for failed geoencoding
+        dbc.Alert(
+            id="alert-fail-geoencode",
+            children=GEOCODE_FAILED_MESSAGE,
+            color="danger",
+            dismissable=True,  # Allows the user to close the alert
+            is_open=False,  # Initially hidden
+            style={'marginTop': '20px'},  # Adjust the margin as needed
+            ),
+
+        # Container for the map
+        html.Div([
+            dcc.Loading(
+                id="loading-map", 
+                children=[
+                    html.Div(
+                        DeckGL(
+                            id="map",
+                            data=deck_data(pdk.Deck(
+                                initial_view_state=pdk.ViewState(
+                                    longitude=ATOCHA[0],
+                                    latitude=ATOCHA[1],
+                                    zoom=5,
+                                    pitch=0,
+                                ),
+                                layers=[],
+                                map_style=CHOSEN_STYLE,                            
+                            )),
+                            mapboxKey=MAPBOX_API_KEY,
+                            tooltip=DRIVER_TOOLTIP
+                        ),
+                        style={'height': '50vh', 'width': '100%'}  # Set the size of the map here
+                    )
+                ], 
+                type="circle"
+            ),
+        ], style={'width': '80%', 'position': 'relative', 'marginTop': '20px'}),  # Adjust marginTop as needed
+        html.Div(id='data-tables-container', children=[]),  # Container for dynamic data tables
+        dcc.Store(id='search-store'),  # Token of the server-side result of the last Submit
+        dcc.Store(id='partition-token-store'),  # Token of the server-side partitions the tables page through
+        dcc.Interval(id='dimensions-interval', interval=DIMENSION_RETRY_SECONDS * 1000),  # Refreshes the dropdown options
+        # html.Button('Create Match', id='create-match', n_clicks=0, style={'marginTop': '20px', 'marginBottom': '20px'}),  # Button for creating matches
+        # dcc.Store(id='drivers-to-match-store'),  # Store for selected drivers' IDs
+    ], style={'display': 'flex', 'flexDirection': 'column', 'alignItems': 'center'})  # This ensures vertical stacking and center alignment
 
 @callback(
-    [Output('map', 'data'), Output('data-tables-container', 'children'), Output('alert-fail-geoencode', 'is_open')],
-    [Input('submit-val', 'n_clicks'), Input('shifts-dropdown', 'value'), Input('managers-dropdown', 'value')],
+    [Output('shifts-dropdown', 'options'), Output('managers-dropdown', 'options'), Output('dimensions-interval', 'interval')],
+    Input('dimensions-interval', 'n_intervals'),
+)
+def refresh_dimension_options(n_intervals):
+    """Fill the shift and manager dropdowns from the shared dimension cache, refreshing it when stale."""
+    try:
+        dimensions = get_dimensions()
+    except Exception as e:
+        print(f"Failed to refresh shifts and managers: {e}")
+        dimensions = cached_dimensions()
+    if dimensions is None:
+        # Nothing fetched yet: try again soon
+        return dash.no_update, dash.no_update, DIMENSION_RETRY_SECONDS * 1000
+    return dimension_options(dimensions, 'shifts'), dimension_options(dimensions, 'managers'), DIMENSION_REFRESH_SECONDS * 1000
+
+SEARCH_INPUTS = (
+    [Output('search-store', 'data'), Output('alert-fail-geoencode', 'is_open'), Output('alert-fail-geoencode', 'children')],
+    Input('submit-val', 'n_clicks'),
     [State('street-input', 'value'),
      State('zip-code-input', 'value'),
-     State('time-limit-range-slider', 'value')]
+     State('time-limit-range-slider', 'value'),
+     State('live-routing-checklist', 'value')],
 )
-def update_map_and_tables(n_clicks, selected_shifts, selected_managers, street, zip_code, time_limits):
-    if n_clicks > 0:
+SEARCH_STAGES = ["Geocoding address", "Computing isochrones", "Labelling drivers"]
+
+def run_search(set_progress, n_clicks, street, zip_code, time_limits, live_routing):
+    """Geocode, fetch isochrones and label every driver with its ring, once per Submit."""
+    try:
+        with trace("run_search", time_limits=time_limits, live_routing=bool(live_routing)):
+            return search(set_progress, street, zip_code, time_limits, live_routing)
+    finally:
+        # A background job's process exits with the job, so hand its stage timings to /metrics now
+        flush_metrics()
+
+def search(set_progress, street, zip_code, time_limits, live_routing):
+    def report(stage):
+        set_progress((100 * stage // len(SEARCH_STAGES), SEARCH_STAGES[stage]))
+
+    with job_slot(on_wait=lambda: set_progress((0, "Waiting for a free worker"))):
+        report(0)
         geoencode_result = geoencode_address(street, zip_code)
-        
         if geoencode_result is None:
             # Geoencoding fails, show the alert
-            return dash.no_update, dash.no_update, True  # Open the alert
-        
-        if geoencode_result:
-            lat, lon = geoencode_result
-            lat, lon = float(lat), float(lon)
-            times = list(range(time_limits[0], time_limits[1] + 1, 5))
+            return dash.no_update, True, GEOCODE_FAILED_MESSAGE  # Open the alert
+
+        lat, lon = geoencode_result
+        lat, lon = float(lat), float(lon)
+        times = list(range(time_limits[0], time_limits[1] + 1, 5))
+        report(1)
+        grid_index = get_grid_index() if GRID_INDEX_ENABLED and not live_routing else None
+        with timed("callback.grid_lookup"):
+            isochrones_geojson = grid_index.lookup(lat, lon, times) if grid_index is not None else None
+        if isochrones_geojson is None:
             isochrones_geojson = calculate_isochrones(lat, lon, times)
-            isochrone_coords = extract_coords_from_encompassing_isochrone(isochrones_geojson)
+        if isochrones_geojson is None:
+            # GraphHopper timed out, failed or its circuit is open
+            return dash.no_update, True, ROUTING_UNAVAILABLE_MESSAGE
+        report(2)
+        # A coarse outline for the map, a finer one for deciding which ring a driver is in
+        render_isochrones, render_stats = simplify_isochrones(isochrones_geojson, RENDER_SIMPLIFY_TOLERANCE)
+        containment_isochrones, containment_stats = simplify_isochrones(isochrones_geojson, CONTAINMENT_SIMPLIFY_TOLERANCE)
+        isochrone_coords = extract_coords_from_encompassing_isochrone(render_isochrones)
+        with timed("callback.compute_view"):
             computed_view_state = pdk.data_utils.compute_view(isochrone_coords, view_proportion=0.9)
-            drivers_df, drivers_gdf, drivers_list = fetch_drivers()
+        if DRIVER_QUERY_MODE == "pushdown":
+            # Candidates are queried and labelled per render, with the dropdown filters pushed into SQL
+            labels = None
+        else:
+            drivers_df, drivers_gdf = get_driver_snapshot()
+            labels = pd.Series(label_drivers_by_isochrones(drivers_gdf, containment_isochrones), index=drivers_gdf['kendra_id'].to_numpy())
+
+    token = uuid.uuid4().hex
+    with timed("callback.cache_search"):
+        SEARCH_CACHE.set(token, {
+            "lat": lat,
+            "lon": lon,
+            "time_limits": time_limits,
+            "isochrones": render_isochrones,
+            "containment_isochrones": containment_isochrones,
+            "simplification": {"render": render_stats, "containment": containment_stats},
+            "view_state": computed_view_state,
+            "labels": labels,
+        })
+    return {"token": token}, False, dash.no_update
+
+if BACKGROUND_CALLBACKS:
+    # Jobs are forked from this worker, so build the local street index here once for all of them to inherit
+    get_address_index()
+    # Runs in a background process so a slow GraphHopper call does not hold a request worker.
+    # Submitting again while a search runs makes Dash cancel the superseded job.
+    callback(
+        *SEARCH_INPUTS,
+        background=True,
+        manager=BACKGROUND_MANAGER,
+        progress=[Output('search-progress', 'value'), Output('search-progress', 'label')],
+        running=[
+            (Output('search-progress-container', 'style'), {'display': 'block', 'marginTop': '10px'}, {'display': 'none'}),
+            (Output('cancel-search', 'style'), {'display': 'inline-block', 'marginLeft': '10px'}, {'display': 'none'}),
+        ],
+        cancel=[Input('cancel-search', 'n_clicks')],
+        prevent_initial_call=True
+    )(run_search)
+else:
+    @callback(*SEARCH_INPUTS, prevent_initial_call=True)
+    def run_search_in_worker(n_clicks, street, zip_code, time_limits, live_routing):
+        return run_search(lambda progress: None, n_clicks, street, zip_code, time_limits, live_routing)
+
+def search_labels(search, drivers_gdf):
+    """Ring labels of a cached search aligned with drivers_gdf, relabelling if the snapshot gained drivers."""
+    labels = search["labels"].reindex(drivers_gdf['kendra_id'].to_numpy())
+    if labels.isna().any():
+        return label_drivers_by_isochrones(drivers_gdf, search["containment_isochrones"])
+    return labels.to_numpy(dtype=np.int16)
+
+@callback(
+    [Output('map', 'data'), Output('data-tables-container', 'children'), Output('partition-token-store', 'data')],
+    [Input('search-store', 'data'), Input('shifts-dropdown', 'value'), Input('managers-dropdown', 'value')],
+    prevent_initial_call=True
+)
+@trace("update_map_and_tables")
+def update_map_and_tables(search_token, selected_shifts, selected_managers):
+    """Filter the labelled drivers of the last Submit and render the map and tables; no geocoding or routing."""
+    search = SEARCH_CACHE.get(search_token["token"]) if search_token else None
+    if search is None:
+        return dash.no_update, dash.no_update, dash.no_update
+
+    lat, lon = search["lat"], search["lon"]
+    time_limits = search["time_limits"]
+    isochrones_geojson = search["isochrones"]
+    if DRIVER_QUERY_MODE == "pushdown":
+        # Only drivers in the outermost ring's area come back; the others matching the filters are just counted
+        exact = PUSHDOWN_AREA == "polygon"
+        area_wkt = encompassing_area_wkt(search["containment_isochrones"], exact)
+        drivers_df, drivers_gdf, uncounted_outside = fetch_candidate_drivers(area_wkt, selected_shifts, selected_managers, exact)
+        labels = label_drivers_by_isochrones(drivers_gdf, search["containment_isochrones"])
+    else:
+        drivers_df, drivers_gdf = get_driver_snapshot()
+        labels = search_labels(search, drivers_gdf)
+        uncounted_outside = 0
+
+        with timed("callback.filter_drivers"):
+            mask = np.ones(len(drivers_gdf), dtype=bool)
             if selected_shifts:
-                drivers_list = [driver for driver in drivers_list if driver['shift'] in selected_shifts]
-                drivers_gdf = drivers_gdf[drivers_gdf['shift'].isin(selected_shifts)]
-            
+                mask &= drivers_gdf['shift'].isin(selected_shifts).to_numpy()
             if selected_managers:
-                drivers_list = [driver for driver in drivers_list if driver['manager'] in selected_managers]
-                drivers_gdf = drivers_gdf[drivers_gdf['manager'].isin(selected_managers)]
-
-            # Define icon data
-            icon_data = {
-                "url": "https://upload.wikimedia.org/wikipedia/commons/3/3b/Blackicon.png",
-                "width": 100,
-                "height": 100,
-                # "anchorY": 242,
-            }
-
-            # Create an IconLayer for the geoencoded point
-            icon_layer = pdk.Layer(
-                "IconLayer",
-                data=[{"coordinates": [lon, lat], "icon_data": icon_data}],
-                get_icon="icon_data",
-                get_size=4,
-                size_scale=15,
-                get_position="coordinates",
-                pickable=True,
-            )
-
-            isochrone_layer = pdk.Layer(
-                "GeoJsonLayer",
-                data=isochrones_geojson,
-                opacity=0.1,
-                stroked=False,
-                filled=True,
-                extruded=False,
-                wireframe=True
-            )
-
-            drivers_layer = pdk.Layer(
-                "ScatterplotLayer",
-                data=drivers_list,
-                get_position="coordinates",
-                get_color="color",
-                get_radius="radius",
-                pickable=True,
-                auto_highlight=True,
-            )
-            initial_view_state = computed_view_state
-
-            new_deck_data = pdk.Deck(
-                layers=[isochrone_layer, drivers_layer, icon_layer],  # Add the icon_layer here
-                initial_view_state=initial_view_state,
-                map_style=CHOSEN_STYLE,
-                tooltip={
-                    "html": "<b>Name:</b> {name}<br><b>Street:</b> {street}<br><b>Manager:</b> {manager}<br><b>Shift:</b> {shift}",
-                    "style": {
-                        "backgroundColor": "steelblue",
-                        "color": "white"
-                    }
-                }
-            ).to_json()
-
-            partitioned_drivers = partition_drivers_by_isochrones(drivers_gdf, isochrones_geojson)
-            # assert check_partitions_intersection(partitioned_drivers), "Partitions are not disjoint!"
-            # Generate data tables for each partition
-            data_tables = []
-            num_partitions = len(partitioned_drivers)
-            for i, partition in enumerate(partitioned_drivers):
-                partition = partition.drop(columns=['geometry', 'lat', 'lng', 'zip_code', 'province', 'city', 'country'])
-                table = dash_table.DataTable(
-                    id={'type': 'drivers-table', 'index': i},
-                    columns=[{"name": col, "id": col} for col in partition.columns],
-                    data=partition.to_dict('records'),
-                    style_table={'overflowX': 'auto'},
-                    page_size=10,
-                    style_cell={'textAlign': 'left'},
-                )
-                if i < num_partitions - 1:
-                    number_of_drivers = len(partition)
-                    iso_title = time_limits[0] + i * 5 
-                    title = f'{number_of_drivers} drivers within {iso_title} minutes of chosen location'
-                else:
-                    # This is the last partition, so we give it a custom title
-                    number_of_drivers = len(partition)
-                    title = f'{number_of_drivers} drivers outside largest isochrone'
-                data_tables.append(html.Div(children=[html.H3(title), table], style={'margin': '20px'}))
-
-            return new_deck_data, data_tables, False
-        else:
-            # No clicks yet, do not update anything and ensure the alert is closed
-            return dash.no_update, dash.no_update, False
-    return dash.no_update, dash.no_update, False
+                mask &= drivers_gdf['manager'].isin(selected_managers).to_numpy()
+            drivers_gdf, labels = drivers_gdf[mask], labels[mask]
+            record_rows("callback.filter_drivers", len(drivers_gdf))
+
+    drivers_layer = build_drivers_layer(drivers_gdf)
+    if MAP_UPDATE_MODE == "patch" and ctx.triggered_id != 'search-store':
+        # Only the driver filter changed: the isochrones, icon and view state on the client are still current
+        new_deck_data = Patch()
+        new_deck_data['layers'][DRIVERS_LAYER_INDEX] = layer_data(drivers_layer)
+    else:
+        # Define icon data
+        icon_data = {
+            "url": "https://upload.wikimedia.org/wikipedia/commons/3/3b/Blackicon.png",
+            "width": 100,
+            "height": 100,
+            # "anchorY": 242,
+        }
 
+        # Create an IconLayer for the geoencoded point
+        icon_layer = pdk.Layer(
+            "IconLayer",
+            data=[{"coordinates": [lon, lat], "icon_data": icon_data}],
+            get_icon="icon_data",
+            get_size=4,
+            size_scale=15,
+            get_position="coordinates",
+            pickable=True,
+        )
+
+        isochrone_layer = pdk.Layer(
+            "GeoJsonLayer",
+            data=isochrones_geojson,
+            opacity=0.1,
+            stroked=False,
+            filled=True,
+            extruded=False,
+            wireframe=True
+        )
+
+        initial_view_state = search["view_state"]
+
+        new_deck_data = deck_data(pdk.Deck(
+            layers=[isochrone_layer, drivers_layer, icon_layer],  # Add the icon_layer here
+            initial_view_state=initial_view_state,
+            map_style=CHOSEN_STYLE,
+            tooltip=DRIVER_TOOLTIP
+        ))
+
+    partitioned_drivers = partitions_from_labels(drivers_gdf, labels, len(isochrones_geojson['features']) + 1)
+    assert check_partitions_intersection(partitioned_drivers), "Partitions are not disjoint!"
+    # Keep the full partitions server-side; the tables only receive counts and their first page
+    partitions = [
+        partition.drop(columns=['geometry', 'lat', 'lng', 'zip_code', 'province', 'city', 'country']).reset_index(drop=True)
+        for partition in partitioned_drivers
+    ]
+    with timed("callback.cache_partitions"):
+        partition_token = cache_partitions(partitions)
+    data_tables = build_partition_tables(partitions, time_limits, uncounted_outside)
+
+    return new_deck_data, data_tables, partition_token
+
+@callback(
+    [Output({'type': 'drivers-table', 'index': MATCH}, 'data'), Output({'type': 'drivers-table', 'index': MATCH}, 'page_count')],
+    [Input({'type': 'drivers-table', 'index': MATCH}, 'page_current'),
+     Input({'type': 'drivers-table', 'index': MATCH}, 'page_size'),
+     Input({'type': 'drivers-table', 'index': MATCH}, 'sort_by'),
+     Input({'type': 'drivers-table', 'index': MATCH}, 'filter_query')],
+    [State({'type': 'drivers-table', 'index': MATCH}, 'id'),
+     State('partition-token-store', 'data')],
+    prevent_initial_call=True
+)
+def page_drivers_table(page_current, page_size, sort_by, filter_query, table_id, partition_token):
+    """Serve one page of a partition table from the cached partitions, sorted and filtered server-side."""
+    page = page_partition(partition_token, table_id['index'], page_current, page_size or PAGE_SIZE, sort_by, filter_query)
+    if page is None:
+        # Partitions expired from the cache; keep what the table shows
+        return dash.no_update, dash.no_update
+    return page
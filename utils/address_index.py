@@ -0,0 +1,38 @@
+import csv
+from db.db_address import normalize_address
+
+
+class AddressIndex:
+    """In-memory map from normalized (street, postal code) to coordinates."""
+
+    def __init__(self):
+        self._coords = {}
+
+    def __len__(self):
+        return len(self._coords)
+
+    def add(self, street, postal_code, lat, lon):
+        if street and lat is not None and lon is not None:
+            self._coords[normalize_address(street, postal_code)] = (float(lat), float(lon))
+
+    def import_csv(self, path):
+        """
+        Index a street list from a CSV with street, postal_code (or zip_code), lat and lon (or lng) columns.
+
+        :return: number of rows read
+        """
+        rows = 0
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                self.add(
+                    row.get("street"),
+                    row.get("postal_code", row.get("zip_code")),
+                    row.get("lat"),
+                    row.get("lon", row.get("lng")),
+                )
+                rows += 1
+        return rows
+
+    def lookup(self, street, postal_code):
+        """Coordinates (lat, lon) of an address, or None if it is not indexed."""
+        return self._coords.get(normalize_address(street, postal_code))
@@ -0,0 +1,81 @@
+import os
+import time
+from contextlib import contextmanager
+from utils.cache_utils import cache_path
+
+try:
+    import diskcache
+    import psutil
+    from dash import DiskcacheManager
+except ImportError:  # diskcache, multiprocess and psutil are optional; callbacks then run in the request worker
+    diskcache = None
+
+# Run long callbacks in background processes instead of the Dash request worker
+BACKGROUND_CALLBACKS = os.getenv("BACKGROUND_CALLBACKS", "1") == "1" and diskcache is not None
+# Background jobs running at once across all workers; further jobs wait for a slot
+MAX_BACKGROUND_JOBS = int(os.getenv("MAX_BACKGROUND_JOBS", 4))
+# Seconds after which a job's slot and result are dropped even if it never finished
+BACKGROUND_JOB_TIMEOUT = int(os.getenv("BACKGROUND_JOB_TIMEOUT", 300))
+
+
+class JobSlots:
+    """
+    Cap on concurrent background jobs, shared by every process through a diskcache.
+
+    A slot is a cache key holding the pid of the job that took it. Dash terminates
+    cancelled jobs without running their cleanup, so slots held by dead processes
+    are reclaimed, and every slot expires after `timeout` seconds regardless.
+    """
+
+    def __init__(self, cache, slots=MAX_BACKGROUND_JOBS, timeout=BACKGROUND_JOB_TIMEOUT, name="job-slot"):
+        self.cache = cache
+        self.keys = [f"{name}-{i}" for i in range(slots)]
+        self.timeout = timeout
+
+    def _try_acquire(self):
+        pid = os.getpid()
+        for key in self.keys:
+            if self.cache.add(key, pid, expire=self.timeout):
+                return key
+            holder = self.cache.get(key)
+            if holder is not None and not psutil.pid_exists(holder):
+                with self.cache.transact():
+                    if self.cache.get(key) == holder:
+                        self.cache.set(key, pid, expire=self.timeout)
+                        return key
+        return None
+
+    @contextmanager
+    def slot(self, on_wait=None, poll=0.2):
+        """
+        Hold a slot for the duration of the block, waiting for one if all are taken.
+
+        :param on_wait: Called once if the job has to wait, e.g. to report it as queued
+        """
+        key = self._try_acquire()
+        if key is None and on_wait is not None:
+            on_wait()
+        while key is None:
+            time.sleep(poll)
+            key = self._try_acquire()
+        try:
+            yield
+        finally:
+            self.cache.delete(key)
+
+
+if BACKGROUND_CALLBACKS:
+    BACKGROUND_CACHE = diskcache.Cache(os.getenv("BACKGROUND_CACHE_DIR", cache_path("background")))
+    BACKGROUND_MANAGER = DiskcacheManager(BACKGROUND_CACHE, expire=BACKGROUND_JOB_TIMEOUT)
+    JOB_SLOTS = JobSlots(BACKGROUND_CACHE)
+else:
+    BACKGROUND_CACHE = BACKGROUND_MANAGER = JOB_SLOTS = None
+
+@contextmanager
+def job_slot(on_wait=None):
+    """Hold one of the MAX_BACKGROUND_JOBS slots; a no-op when callbacks run in the request worker."""
+    if JOB_SLOTS is None:
+        yield
+    else:
+        with JOB_SLOTS.slot(on_wait):
+            yield
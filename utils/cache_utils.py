@@ -0,0 +1,266 @@
+import os
+import json
+import time
+import pickle
+import sqlite3
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Per-user by default, so no other local user can pre-create it
+CACHE_DIR = os.getenv(
+    "AUTOMATCH_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), f"automatch-{os.getuid()}" if hasattr(os, "getuid") else "automatch"),
+)
+
+
+def ensure_private_dir(path: str):
+    """
+    Create `path` accessible to its owner only, and refuse it if it is owned by another user or writable by others.
+
+    Cache entries are unpickled on read, so whoever can write into the cache directory can run code as the app.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if not hasattr(os, "getuid"):
+        return
+    stat = os.stat(path)
+    if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+        raise PermissionError(
+            f"Cache directory {path} must be owned by uid {os.getuid()} and not writable by group or others"
+        )
+
+def cache_path(filename: str) -> str:
+    """Return the path of a cache file inside CACHE_DIR, creating the private directory if needed."""
+    ensure_private_dir(CACHE_DIR)
+    return os.path.join(CACHE_DIR, filename)
+
+
+@contextmanager
+def file_lease(filename: str, stale_after: float = 60):
+    """
+    Cross-process lease on a file in CACHE_DIR: yields True to the one holder and False to everyone else.
+
+    A lease older than `stale_after` seconds is taken to be left behind by a crashed holder and is taken over.
+    """
+    path = cache_path(filename)
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        try:
+            abandoned = time.time() - os.path.getmtime(path) > stale_after
+        except FileNotFoundError:
+            abandoned = True
+        if abandoned:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            yield False
+            return
+    os.close(fd)
+    try:
+        yield True
+    finally:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class TTLCache:
+    """
+    LRU cache with a time-to-live on every entry.
+
+    Entries live in a bounded in-process LRU and, when `path` is given, in a SQLite
+    file that every Dash/gunicorn worker on the host can share. A miss in memory
+    falls through to disk before being reported as a miss.
+
+    :param maxsize: Maximum number of entries kept in memory.
+    :param ttl: Seconds an entry stays valid.
+    :param path: SQLite file for the shared on-disk tier, or None for memory only.
+    :param disk_maxsize: Maximum number of entries kept on disk (defaults to 8 * maxsize).
+    """
+
+    def __init__(self, maxsize=256, ttl=3600, path=None, disk_maxsize=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self.disk_maxsize = disk_maxsize or maxsize * 8
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if hasattr(os, "register_at_fork"):
+            # A forked background job must not inherit the lock held by another thread of the parent
+            os.register_at_fork(after_in_child=self._after_fork)
+        if self.path:
+            with self._disk() as conn:
+                conn.execute("PRAGMA journal_mode=WAL;")
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS entries (
+                        key TEXT PRIMARY KEY,
+                        value BLOB NOT NULL,
+                        expires_at REAL NOT NULL,
+                        accessed_at REAL NOT NULL
+                    );
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at);")
+
+    @contextmanager
+    def _disk(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def _remember(self, key, value, expires_at):
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+        if self.path:
+            with self._disk() as conn:
+                row = conn.execute(
+                    "SELECT value, expires_at FROM entries WHERE key = ? AND expires_at > ?;", (key, now)
+                ).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?;", (now, key))
+            if row is not None:
+                value = pickle.loads(row[0])
+                with self._lock:
+                    self._remember(key, value, row[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def set(self, key, value):
+        now = time.time()
+        expires_at = now + self.ttl
+        with self._lock:
+            self._remember(key, value, expires_at)
+
+        if self.path:
+            with self._disk() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?);",
+                    (key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), expires_at, now),
+                )
+                conn.execute("DELETE FROM entries WHERE expires_at <= ?;", (now,))
+                conn.execute("""
+                    DELETE FROM entries WHERE key IN (
+                        SELECT key FROM entries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                    );
+                """, (self.disk_maxsize,))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.path:
+            with self._disk() as conn:
+                conn.execute("DELETE FROM entries;")
+
+    def stats(self) -> dict:
+        """Hit/miss counters for this process, plus current sizes."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "memory_entries": len(self._entries),
+            }
+        if self.path:
+            with self._disk() as conn:
+                stats["disk_entries"] = conn.execute("SELECT COUNT(*) FROM entries;").fetchone()[0]
+        return stats
+
+
+class SharedState:
+    """
+    Small JSON values updated atomically, shared by every process on the host through a SQLite file.
+
+    update() reads, transforms and writes a value inside one write transaction, so
+    request workers and background jobs see each other's updates in order. Without
+    `path` the values live in this process only.
+
+    :param path: SQLite file holding the values, or None for this process only.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._values = {}
+        self._lock = threading.Lock()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+        if self.path:
+            with self._disk() as conn:
+                conn.execute("PRAGMA journal_mode=WAL;")
+                conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL);")
+
+    @contextmanager
+    def _disk(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def update(self, key, transition, default=None):
+        """
+        Replace the value of `key` with transition(value), atomically across processes.
+
+        :param transition: function(value) -> (new value, result); `value` is `default` if unset
+        :return: the transition's result
+        """
+        if not self.path:
+            with self._lock:
+                value, result = transition(self._values.get(key, default))
+                self._values[key] = value
+                return result
+        with self._disk() as conn:
+            conn.execute("BEGIN IMMEDIATE;")
+            try:
+                row = conn.execute("SELECT value FROM state WHERE key = ?;", (key,)).fetchone()
+                value, result = transition(json.loads(row[0]) if row else default)
+                text = json.dumps(value)
+                if row is None or text != row[0]:
+                    conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?);", (key, text))
+                conn.execute("COMMIT;")
+            except BaseException:
+                conn.execute("ROLLBACK;")
+                raise
+        return result
@@ -0,0 +1,108 @@
+import os
+import json
+import numpy as np
+import pydeck as pdk
+from utils.metrics import timed, record_bytes, record_rows
+
+DRIVER_COLOR = [255, 0, 0, 255]
+DRIVER_RADIUS = 50
+# 5 decimals of a degree is ~1 m, more than enough for a driver's home address
+COORDINATE_DECIMALS = 5
+# "compact" ships short per-driver rows with layer-level constants, "records" the legacy verbose rows
+DRIVER_LAYER_MODE = os.getenv("DRIVER_LAYER_MODE", "compact")
+
+TOOLTIP_STYLE = {
+    "backgroundColor": "steelblue",
+    "color": "white"
+}
+RECORDS_TOOLTIP = {
+    "html": "<b>Name:</b> {name}<br><b>Street:</b> {street}<br><b>Manager:</b> {manager}<br><b>Shift:</b> {shift}",
+    "style": TOOLTIP_STYLE,
+}
+# Compact rows use one-letter keys for the tooltip fields
+COMPACT_TOOLTIP = {
+    "html": "<b>Name:</b> {n}<br><b>Street:</b> {s}<br><b>Manager:</b> {m}<br><b>Shift:</b> {t}",
+    "style": TOOLTIP_STYLE,
+}
+DRIVER_TOOLTIP = COMPACT_TOOLTIP if DRIVER_LAYER_MODE == "compact" else RECORDS_TOOLTIP
+# "patch" updates only the changed layers of the map on filter changes, "full" resends the whole deck
+MAP_UPDATE_MODE = os.getenv("MAP_UPDATE_MODE", "patch")
+# Position of each layer in the deck, so partial updates can address them
+ISOCHRONE_LAYER_INDEX, DRIVERS_LAYER_INDEX, ICON_LAYER_INDEX = 0, 1, 2
+
+
+def driver_positions(drivers_gdf) -> np.ndarray:
+    """(n, 2) array of driver [lng, lat] positions."""
+    return np.column_stack([drivers_gdf.geometry.x.to_numpy(), drivers_gdf.geometry.y.to_numpy()])
+
+def compact_drivers_data(drivers_gdf) -> list:
+    """
+    Short per-driver rows for the ScatterplotLayer.
+
+    Still one JSON object per driver: dash_deck only passes JSON to deck.gl, so typed
+    binary attributes are not available. Positions are quantized to COORDINATE_DECIMALS,
+    color and radius are left to layer-level constants, and only the tooltip fields
+    are kept, under one-letter keys.
+    """
+    positions = np.round(driver_positions(drivers_gdf), COORDINATE_DECIMALS).tolist()
+    columns = [drivers_gdf[column].tolist() for column in ("name", "street", "manager", "shift")]
+    return [
+        {"p": position, "n": name, "s": street, "m": manager, "t": shift}
+        for position, name, street, manager, shift in zip(positions, *columns)
+    ]
+
+def records_drivers_data(drivers_gdf) -> list:
+    """Legacy per-driver rows carrying their own color and radius."""
+    positions = driver_positions(drivers_gdf).tolist()
+    columns = [drivers_gdf[column].tolist() for column in ("name", "street", "manager", "shift")]
+    return [
+        {
+            "coordinates": position,
+            "color": DRIVER_COLOR,
+            "radius": DRIVER_RADIUS,
+            "name": name,
+            "street": street,
+            "manager": manager,
+            "shift": shift
+        } for position, name, street, manager, shift in zip(positions, *columns)
+    ]
+
+@timed("deck.build_drivers_layer")
+def build_drivers_layer(drivers_gdf, mode=DRIVER_LAYER_MODE):
+    """ScatterplotLayer of drivers in the given payload mode ("compact" or "records")."""
+    record_rows("deck.build_drivers_layer", len(drivers_gdf))
+    if mode == "compact":
+        return pdk.Layer(
+            "ScatterplotLayer",
+            id="drivers",
+            data=compact_drivers_data(drivers_gdf),
+            get_position="p",
+            get_fill_color=DRIVER_COLOR,
+            get_radius=DRIVER_RADIUS,
+            pickable=True,
+            auto_highlight=True,
+        )
+    return pdk.Layer(
+        "ScatterplotLayer",
+        id="drivers",
+        data=records_drivers_data(drivers_gdf),
+        get_position="coordinates",
+        get_color="color",
+        get_radius="radius",
+        pickable=True,
+        auto_highlight=True,
+    )
+
+def deck_data(deck) -> dict:
+    """Deck as the dict dash_deck accepts, so later updates can patch into it."""
+    with timed("deck.to_json"):
+        text = deck.to_json()
+    record_bytes("deck.to_json", len(text))
+    return json.loads(text)
+
+def layer_data(layer) -> dict:
+    """Layer serialized exactly as it appears inside deck_data()["layers"]."""
+    with timed("deck.layer_to_json"):
+        text = layer.to_json()
+    record_bytes("deck.layer_to_json", len(text))
+    return json.loads(text)
@@ -0,0 +1,146 @@
+import os
+import time
+import hashlib
+import argparse
+import threading
+from time import perf_counter
+import numpy as np
+import shapely
+from shapely.geometry import Point, shape
+from db.db_connect import pooled_connection, localauth
+from utils.graphhopper_client import fetch_many
+from utils.geo_utils import ISOCHRONE_CLIENT, simplify_isochrones, CONTAINMENT_SIMPLIFY_TOLERANCE
+
+# Minutes of driving each driver's reach polygon covers
+DRIVER_REACH_MINUTES = int(os.getenv("DRIVER_REACH_MINUTES", 15))
+# Minimum seconds between two checks for a changed DriverReach table
+DRIVER_REACH_PROBE_INTERVAL = float(os.getenv("DRIVER_REACH_PROBE_INTERVAL", 60))
+
+
+def address_hash(street, zip_code, lat, lng, minutes) -> str:
+    """Fingerprint of everything a driver's reach polygon depends on."""
+    return hashlib.sha1(repr((street, zip_code, lat, lng, minutes)).encode()).hexdigest()
+
+def refresh_driver_reach(auth=localauth, minutes=DRIVER_REACH_MINUTES, max_concurrency=8):
+    """
+    Compute the `minutes` isochrone of every driver whose address changed since it was last computed.
+
+    Reach polygons are driven outward from the driver's home, simplified and stored as
+    WKB in DriverReach next to the hash of the address they were computed from, so
+    unchanged drivers cost no routing call.
+
+    :return: dict with drivers checked, recomputed and failed, and elapsed seconds
+    """
+    start = perf_counter()
+    with pooled_connection(auth) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT D.kendra_id, D.street, D.zip_code, D.lat, D.lng, R.address_hash
+                FROM Drivers D
+                    LEFT JOIN DriverReach R ON R.driver_id = D.kendra_id;
+            """)
+            drivers = cursor.fetchall()
+
+    stale = []
+    for kendra_id, street, zip_code, lat, lng, stored_hash in drivers:
+        current_hash = address_hash(street, zip_code, lat, lng, minutes)
+        if current_hash != stored_hash and lat is not None and lng is not None:
+            stale.append((kendra_id, lat, lng, current_hash))
+
+    requests = [(lat, lng, minutes * 60, 1) for _, lat, lng, _ in stale]
+    results = fetch_many(ISOCHRONE_CLIENT.isochrones, requests, max_concurrency)
+    rows = []
+    for (kendra_id, _, _, current_hash), features in zip(stale, results):
+        if not features:
+            continue
+        simplified, _ = simplify_isochrones(dict(type="FeatureCollection", features=features[-1:]), CONTAINMENT_SIMPLIFY_TOLERANCE)
+        polygon = shape(simplified["features"][0]["geometry"])
+        rows.append((kendra_id, minutes, current_hash, shapely.to_wkb(polygon)))
+
+    with pooled_connection(auth) as conn:
+        with conn.cursor() as cursor:
+            cursor.executemany("""
+                INSERT INTO DriverReach (driver_id, minutes, address_hash, polygon, computed_at)
+                VALUES (%s, %s, %s, %s, NOW())
+                ON DUPLICATE KEY UPDATE minutes=VALUES(minutes), address_hash=VALUES(address_hash),
+                polygon=VALUES(polygon), computed_at=VALUES(computed_at);
+            """, rows)
+        conn.commit()
+
+    report = {
+        "drivers": len(drivers),
+        "recomputed": len(rows),
+        "failed": len(stale) - len(rows),
+        "seconds": perf_counter() - start,
+    }
+    print(f"DriverReach: {report['recomputed']} of {report['drivers']} drivers recomputed, "
+          f"{report['failed']} failed in {report['seconds']:.2f}s")
+    return report
+
+
+class DriverReachIndex:
+    """STRtree over the drivers' reach polygons."""
+
+    def __init__(self, driver_ids, polygons):
+        self.driver_ids = np.asarray(driver_ids)
+        self.polygons = polygons
+        self.tree = shapely.STRtree(polygons)
+
+    def __len__(self):
+        return len(self.driver_ids)
+
+    def drivers_reaching(self, lat: float, lon: float) -> np.ndarray:
+        """kendra_ids of the drivers whose reach polygon contains the point."""
+        return self.driver_ids[self.tree.query(Point(lon, lat), predicate="within")]
+
+    def drivers_reaching_many(self, lats, lons):
+        """
+        Drivers reaching each of many points, in one tree query.
+
+        :return: (point indices, kendra_ids) arrays, one entry per point and driver whose polygon contains it
+        """
+        points, polygons = self.tree.query(shapely.points(np.asarray(lons, dtype=float), np.asarray(lats, dtype=float)),
+                                           predicate="within")
+        return points, self.driver_ids[polygons]
+
+
+_reach_index = {"index": None, "version": None, "probed_at": 0.0}
+_reach_index_lock = threading.Lock()
+
+def fetch_driver_reach_version(auth=localauth):
+    with pooled_connection(auth) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*), MAX(computed_at) FROM DriverReach;")
+            return cursor.fetchone()
+
+def load_driver_reach_index(auth=localauth) -> DriverReachIndex:
+    with pooled_connection(auth) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT driver_id, polygon FROM DriverReach;")
+            rows = cursor.fetchall()
+    driver_ids = [driver_id for driver_id, _ in rows]
+    polygons = shapely.from_wkb([bytes(polygon) for _, polygon in rows])
+    return DriverReachIndex(driver_ids, polygons)
+
+def get_driver_reach_index(auth=localauth) -> DriverReachIndex:
+    """Process-level DriverReachIndex, reloaded when DriverReach changes."""
+    with _reach_index_lock:
+        now = time.time()
+        if _reach_index["index"] is not None and now - _reach_index["probed_at"] < DRIVER_REACH_PROBE_INTERVAL:
+            return _reach_index["index"]
+        version = fetch_driver_reach_version(auth)
+        _reach_index["probed_at"] = now
+        if _reach_index["index"] is None or version != _reach_index["version"]:
+            _reach_index.update(index=load_driver_reach_index(auth), version=version)
+        return _reach_index["index"]
+
+def drivers_reaching(lat: float, lon: float, auth=localauth) -> np.ndarray:
+    """kendra_ids of the drivers who can reach (lat, lon) within DRIVER_REACH_MINUTES, without a routing call."""
+    return get_driver_reach_index(auth).drivers_reaching(lat, lon)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute the reach polygons of drivers whose address changed")
+    parser.add_argument("--minutes", type=int, default=DRIVER_REACH_MINUTES, help="minutes of driving per polygon")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent isochrone requests")
+    args = parser.parse_args()
+    refresh_driver_reach(localauth, args.minutes, args.workers)
@@ -1,53 +1,212 @@
 import os
 import json
+import time
+import math
+import threading
 import requests as req
 import pandas as pd
+import numpy as np
 import geopandas as gpd
+import shapely
 from db.db_connect import connect, localauth
-from shapely.geometry import shape
+from shapely.geometry import shape, mapping
+from utils.cache_utils import TTLCache, SharedState, cache_path
+from utils.address_index import AddressIndex, normalize_address
+from db.db_support import lookup_driver_address
+from utils.graphhopper_client import IsochroneClient, CircuitBreaker, fetch_many
+from utils.metrics import timed, record_rows, record_bytes
 
-GRAPHHOPPER_URL = "http://localhost:8989/isochrone"
+GRAPHHOPPER_URL = os.getenv("GRAPHHOPPER_URL", "http://localhost:8989/isochrone")
 FIVE_MINUTES = 300
 MAPBOX_API_KEY = os.environ["MAPBOX_TOKEN"]
 BASE_URL = "http://localhost:8989/isochrone"
 
+GRAPHHOPPER_CONNECT_TIMEOUT = float(os.getenv("GRAPHHOPPER_CONNECT_TIMEOUT", 3.05))
+GRAPHHOPPER_READ_TIMEOUT = float(os.getenv("GRAPHHOPPER_READ_TIMEOUT", 15))
+GRAPHHOPPER_RETRIES = int(os.getenv("GRAPHHOPPER_RETRIES", 2))
+GRAPHHOPPER_MAX_CONCURRENCY = int(os.getenv("GRAPHHOPPER_MAX_CONCURRENCY", 8))
+# GraphHopper circuit and Nominatim rate limit, shared by every request worker and background job
+# on the host; empty keeps them per process
+SHARED_STATE = SharedState(os.getenv("SHARED_STATE_PATH", cache_path("shared_state.sqlite")) or None)
+ISOCHRONE_CLIENT = IsochroneClient(
+    GRAPHHOPPER_URL,
+    timeout=(GRAPHHOPPER_CONNECT_TIMEOUT, GRAPHHOPPER_READ_TIMEOUT),
+    retries=GRAPHHOPPER_RETRIES,
+    pool_size=GRAPHHOPPER_MAX_CONCURRENCY,
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.getenv("GRAPHHOPPER_BREAKER_FAILURES", 5)),
+        reset_timeout=float(os.getenv("GRAPHHOPPER_BREAKER_RESET", 30)),
+        state=SHARED_STATE,
+        name="graphhopper",
+    ),
+)
 
-def geoencode_address(address: str, postal_code: str):
+# Points are snapped to this many decimals (~11 m) before querying GraphHopper,
+# so nearby geocodes of the same address share one cache entry.
+ISOCHRONE_SNAP_DECIMALS = int(os.getenv("ISOCHRONE_SNAP_DECIMALS", 4))
+ISOCHRONE_CACHE = TTLCache(
+    maxsize=int(os.getenv("ISOCHRONE_CACHE_SIZE", 256)),
+    ttl=int(os.getenv("ISOCHRONE_CACHE_TTL", 24 * 60 * 60)),
+    path=os.getenv("ISOCHRONE_CACHE_PATH", cache_path("isochrones.sqlite")) or None,
+)
+
+# Simplification tolerances in degrees (0.0005 is ~50 m, 0.0001 ~10 m); 0 disables simplification.
+# The map can afford a coarser outline than the point-in-polygon test.
+RENDER_SIMPLIFY_TOLERANCE = float(os.getenv("RENDER_SIMPLIFY_TOLERANCE", 0.0005))
+CONTAINMENT_SIMPLIFY_TOLERANCE = float(os.getenv("CONTAINMENT_SIMPLIFY_TOLERANCE", 0.0001))
+# Isochrone coordinates are snapped to this many decimals after simplification (5 is ~1 m)
+ISOCHRONE_COORDINATE_DECIMALS = int(os.getenv("ISOCHRONE_COORDINATE_DECIMALS", 5))
+
+NOMINATIM_URL = os.getenv("NOMINATIM_URL", "https://nominatim.openstreetmap.org/search")
+NOMINATIM_TIMEOUT = float(os.getenv("NOMINATIM_TIMEOUT", 5))
+# Nominatim's usage policy allows at most one request per second
+NOMINATIM_MIN_INTERVAL = float(os.getenv("NOMINATIM_MIN_INTERVAL", 1))
+# Optional CSV street list (street, postal_code, lat, lon) merged into the local address index
+ADDRESS_INDEX_CSV = os.getenv("ADDRESS_INDEX_CSV")
+GEOCODE_CACHE = TTLCache(
+    maxsize=int(os.getenv("GEOCODE_CACHE_SIZE", 4096)),
+    ttl=int(os.getenv("GEOCODE_CACHE_TTL", 30 * 24 * 60 * 60)),
+    path=os.getenv("GEOCODE_CACHE_PATH", cache_path("geocodes.sqlite")) or None,
+)
+
+_address_index = {"index": None}
+_address_index_lock = threading.Lock()
+
+def _after_fork_in_child():
+    global _address_index_lock
+    _address_index_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+@timed("geo.get_address_index")
+def get_address_index() -> AddressIndex:
+    """
+    Local address index of the ADDRESS_INDEX_CSV street list, built once per process.
+
+    Processes forked after it is built, such as background jobs, inherit it.
+    """
+    with _address_index_lock:
+        if _address_index["index"] is None:
+            index = AddressIndex()
+            if ADDRESS_INDEX_CSV:
+                index.import_csv(ADDRESS_INDEX_CSV)
+            _address_index["index"] = index
+        return _address_index["index"]
+
+def lookup_driver_home(address: str, postal_code: str):
+    """Coordinates of a driver's home at this address from the database, or None, also when it is unavailable."""
+    try:
+        return lookup_driver_address(address, postal_code)
+    except Exception as e:
+        print(f"Driver address lookup failed: {e}")
+        return None
+
+def reserve_nominatim_slot(last_request):
+    """Book the next Nominatim request NOMINATIM_MIN_INTERVAL after the last booked one; return (booked time, wait)."""
+    now = time.time()
+    booked = max(now, (last_request or 0.0) + NOMINATIM_MIN_INTERVAL)
+    return booked, booked - now
+
+@timed("geo.nominatim_search")
+def nominatim_search(address: str, postal_code: str):
     """ Get coordinates from Nominatim API, assuming the address is in Spain """
-    address += f", Madrid {postal_code}"
+    address += f", Madrid {postal_code or ''}"
     params = {'q': address, 'format': 'json'}
-    response = req.get('https://nominatim.openstreetmap.org/search', params=params)
-    data = response.json()
+    headers = {'User-Agent': 'automatch'}
+    wait = SHARED_STATE.update("nominatim-last-request", reserve_nominatim_slot)
+    if wait > 0:
+        time.sleep(wait)
+    try:
+        response = req.get(NOMINATIM_URL, params=params, headers=headers, timeout=NOMINATIM_TIMEOUT)
+        response.raise_for_status()
+        record_bytes("geo.nominatim_search", len(response.content))
+        data = response.json()
+    except (req.RequestException, ValueError) as e:
+        print(f"Failed to geocode {address!r}: {e}")
+        return None
     if not data:
         return None
-    return data[0]['lat'], data[0]['lon']
+    return float(data[0]['lat']), float(data[0]['lon'])
+
+@timed("geo.geoencode_address")
+def geoencode_address(address: str, postal_code: str):
+    """
+    Coordinates (lat, lon) of an address in Madrid, or None if it cannot be found.
+
+    Looks in the persistent geocode cache and the in-process street list first, which
+    need no network access. Drivers' home addresses are not held in memory, so that
+    processes do not load the whole fleet; they cost one indexed MySQL query, made only
+    on a cache miss and cached with the result. Only then is Nominatim asked, with a
+    timeout and rate limit.
+    """
+    key = normalize_address(address, postal_code)
+    coords = GEOCODE_CACHE.get(key)
+    if coords is not None:
+        return coords
+
+    coords = get_address_index().lookup(address, postal_code)
+    if coords is None:
+        coords = lookup_driver_home(address, postal_code)
+    if coords is None:
+        coords = nominatim_search(address, postal_code)
+    if coords is not None:
+        GEOCODE_CACHE.set(key, coords)
+    return coords
+
+def isochrone_cache_key(lat: float, lon: float, times: list, vehicle: str = "car") -> str:
+    """Cache key for an isochrone request: snapped point, vehicle profile and time limits."""
+    lat, lon = round(lat, ISOCHRONE_SNAP_DECIMALS), round(lon, ISOCHRONE_SNAP_DECIMALS)
+    # "exact": entries cached before rings matched the requested limits are never read
+    return f"{lat:.{ISOCHRONE_SNAP_DECIMALS}f},{lon:.{ISOCHRONE_SNAP_DECIMALS}f}|{vehicle}|exact|{','.join(map(str, times))}"
 
-def calculate_isochrones(lat: float, lon: float, times: list) -> dict:
-    """Fetch isochrones for specified times."""
+def isochrone_cache_stats() -> dict:
+    """Hit/miss counters of the isochrone cache for this worker."""
+    return ISOCHRONE_CACHE.stats()
+
+@timed("geo.calculate_isochrones")
+def calculate_isochrones(lat: float, lon: float, times: list, vehicle: str = "car") -> dict:
+    """
+    Fetch isochrones for specified times, going to GraphHopper only on a cache miss.
+
+    GraphHopper splits its time limit into equal buckets, so the request asks for one
+    ring per common step of `times` and keeps the rings at the requested limits:
+    [20, 25, 30] gets the 20, 25 and 30-minute rings, not 10, 20 and 30.
+
+    :return: FeatureCollection with one ring per time limit, in the order of `times`, or None on failure
+    """
+    key = isochrone_cache_key(lat, lon, times, vehicle)
+    isochrones_geojson = ISOCHRONE_CACHE.get(key)
+    if isochrones_geojson is not None:
+        return isochrones_geojson
+
+    lat, lon = round(lat, ISOCHRONE_SNAP_DECIMALS), round(lon, ISOCHRONE_SNAP_DECIMALS)
     max_time = max(times)  # The furthest time limit
-    buckets = len(times)  # The number of isochrones to generate
-    params = {
-        "point": f"{lat},{lon}",
-        "time_limit": max_time * 60,  # Convert to seconds
-        "vehicle": "car",
-        "buckets": buckets
-    }
-    response = req.get(GRAPHHOPPER_URL, params=params)
-    if response.status_code == 200:
-        isochrones_features = response.json().get("polygons")
-        if isochrones_features is not None:
-            isochrones_geojson = dict(type="FeatureCollection", features=isochrones_features)
-            # isochrones_gdf = gpd.GeoDataFrame.from_features(isochrones_geojson['features']).set_crs(4326)
-            return isochrones_geojson
-        else:
-            print("No features found in the response.")
-            return None
-    else:
-        print(f"Failed to fetch isochrones: {response.status_code}")
+    step = math.gcd(*times)  # Every requested limit is a whole number of buckets
+    buckets = max_time // step  # The number of isochrones to generate
+    isochrones_features = ISOCHRONE_CLIENT.isochrones(lat, lon, max_time * 60, buckets, vehicle)  # Convert to seconds
+    if isochrones_features is None:
         return None
+    isochrones_features = sorted(isochrones_features, key=lambda feature: feature.get("properties", {}).get("bucket", 0))
+    if len(isochrones_features) != buckets:
+        print(f"Expected {buckets} isochrones from GraphHopper, got {len(isochrones_features)}")
+        return None
+    isochrones_features = [isochrones_features[time_limit // step - 1] for time_limit in times]
+    isochrones_geojson = dict(type="FeatureCollection", features=isochrones_features)
+    # isochrones_gdf = gpd.GeoDataFrame.from_features(isochrones_geojson['features']).set_crs(4326)
+    ISOCHRONE_CACHE.set(key, isochrones_geojson)
+    return isochrones_geojson
 
+@timed("geo.calculate_isochrones_many")
+def calculate_isochrones_many(requests, max_concurrency=GRAPHHOPPER_MAX_CONCURRENCY) -> list:
+    """
+    Isochrones for many (lat, lon, times) requests, fetched concurrently with at most
+    `max_concurrency` GraphHopper calls in flight. Cached points cost no call.
 
-
+    :return: FeatureCollections (or None on failure) in the order of `requests`
+    """
+    return fetch_many(calculate_isochrones, requests, max_concurrency)
 
 def extract_geometries_from_feature_collection(feature_collection):
     """
@@ -59,6 +218,91 @@ def extract_geometries_from_feature_collection(feature_collection):
     geometries = [feature["geometry"] for feature in feature_collection["features"]]
     return geometries
 
+@timed("geo.simplify_isochrones")
+def simplify_isochrones(isochrones, tolerance, decimals=ISOCHRONE_COORDINATE_DECIMALS):
+    """
+    Simplify and quantize every isochrone polygon of a FeatureCollection.
+
+    Simplification is topology-preserving, so rings stay valid polygons, and
+    coordinates are snapped to a grid of 10**-decimals degrees. Feature properties
+    (such as the GraphHopper bucket) are kept.
+
+    :param isochrones: FeatureCollection of isochrones
+    :param tolerance: Simplification tolerance in degrees, 0 to only quantize
+    :param decimals: Decimals kept in every coordinate
+    :return: (simplified FeatureCollection, dict with vertex counts before and after per feature and in total)
+    """
+    features = []
+    before, after = [], []
+    for feature in isochrones["features"]:
+        geometry = shape(feature["geometry"])
+        before.append(int(shapely.get_num_coordinates(geometry)))
+        if tolerance > 0:
+            geometry = geometry.simplify(tolerance, preserve_topology=True)
+        geometry = shapely.set_precision(geometry, 10 ** -decimals)
+        after.append(int(shapely.get_num_coordinates(geometry)))
+        features.append({**feature, "geometry": mapping(geometry)})
+    stats = {
+        "vertices_before": sum(before),
+        "vertices_after": sum(after),
+        "feature_vertices_before": before,
+        "feature_vertices_after": after,
+    }
+    return dict(isochrones, features=features), stats
+
+@timed("geo.label_drivers_by_isochrones")
+def label_drivers_by_isochrones(drivers_gdf, isochrones) -> np.ndarray:
+    """
+    Label every driver with the innermost isochrone ring that contains it.
+
+    Drivers outside the bounding box of all rings are labelled without any
+    containment test. The rest are tested against prepared ring geometries,
+    innermost first, and each driver is only tested until it gets a label and
+    only against rings whose bounding box contains it.
+
+    :param drivers_gdf: GeoDataFrame of drivers (point geometries)
+    :param isochrones: FeatureCollection of isochrones, ordered from innermost to outermost
+    :return: int16 array aligned with drivers_gdf, holding the ring index of each driver,
+             or the number of rings for drivers outside all isochrones.
+    """
+    rings = [shape(geometry) for geometry in extract_geometries_from_feature_collection(isochrones)]
+    num_rings = len(rings)
+    labels = np.full(len(drivers_gdf), num_rings, dtype=np.int16)
+    if not num_rings or not len(drivers_gdf):
+        return labels
+
+    record_rows("geo.label_drivers_by_isochrones", len(drivers_gdf))
+    x = drivers_gdf.geometry.x.to_numpy()
+    y = drivers_gdf.geometry.y.to_numpy()
+    minx, miny, maxx, maxy = shapely.total_bounds(rings)
+    candidates = np.flatnonzero((x >= minx) & (x <= maxx) & (y >= miny) & (y <= maxy))
+
+    for ring_index, ring in enumerate(rings):
+        if not len(candidates):
+            break
+        shapely.prepare(ring)
+        rminx, rminy, rmaxx, rmaxy = ring.bounds
+        cx, cy = x[candidates], y[candidates]
+        in_bbox = (cx >= rminx) & (cx <= rmaxx) & (cy >= rminy) & (cy <= rmaxy)
+        inside = np.zeros(len(candidates), dtype=bool)
+        inside[in_bbox] = shapely.contains_xy(ring, cx[in_bbox], cy[in_bbox])
+        labels[candidates[inside]] = ring_index
+        candidates = candidates[~inside]
+
+    return labels
+
+@timed("geo.partitions_from_labels")
+def partitions_from_labels(drivers_gdf, labels, num_partitions):
+    """
+    Split drivers into one GeoDataFrame per ring label with a single stable sort.
+
+    :return: List of GeoDataFrames; partition i holds the drivers labelled i.
+    """
+    order = np.argsort(labels, kind="stable")
+    bounds = np.searchsorted(labels[order], np.arange(num_partitions + 1))
+    return [drivers_gdf.iloc[order[bounds[i]:bounds[i + 1]]] for i in range(num_partitions)]
+
+@timed("geo.partition_drivers_by_isochrones")
 def partition_drivers_by_isochrones(drivers_gdf, isochrones):
     """
     Partition drivers based on whether they fall within nested isochrones.
@@ -68,40 +312,40 @@ def partition_drivers_by_isochrones(drivers_gdf, isochrones):
     :return: List of GeoDataFrames, each corresponding to drivers within a specific isochrone, 
              and the last one containing drivers outside all isochrones.
     """
-    partitioned_drivers = []
-    remaining_drivers = drivers_gdf.copy()
-    isochrone_geoms = extract_geometries_from_feature_collection(isochrones)
-    for isochrone in isochrone_geoms:
-        isochrone_geom = shape(isochrone)
-        within_isochrone = remaining_drivers[remaining_drivers.geometry.within(isochrone_geom)]
-        partitioned_drivers.append(within_isochrone)
-        remaining_drivers = remaining_drivers[~remaining_drivers.index.isin(within_isochrone.index)]
-    
-    partitioned_drivers.append(remaining_drivers)  # Drivers outside all isochrones
-    
-    return partitioned_drivers
+    labels = label_drivers_by_isochrones(drivers_gdf, isochrones)
+    return partitions_from_labels(drivers_gdf, labels, len(isochrones["features"]) + 1)
 
+@timed("geo.extract_coords_from_encompassing_isochrone")
 def extract_coords_from_encompassing_isochrone(geojson):
+    """
+    Outline coordinates of the largest isochrone, for fitting the map view.
+
+    Taken from its convex hull, since simplification and quantization can turn the
+    ring into a MultiPolygon, which has no single exterior.
+    """
     largest_isochrone = geojson['features'][-1]
-    polygon = shape(largest_isochrone['geometry'])
-    exterior_coords = list(polygon.exterior.coords)
-    return exterior_coords
+    geometry = shape(largest_isochrone['geometry'])
+    return [tuple(coords) for coords in shapely.get_coordinates(geometry.convex_hull).tolist()]
+
+def encompassing_area_wkt(isochrones, exact=False) -> str:
+    """WKT of the outermost isochrone, or of its bounding rectangle unless exact, for pushing into SQL."""
+    outermost = shape(isochrones["features"][-1]["geometry"])
+    return (outermost if exact else shapely.box(*outermost.bounds)).wkt
 
+@timed("geo.check_partitions_intersection")
 def check_partitions_intersection(partitioned_drivers):
     """
     Check that the intersection of every pairwise partition is empty.
+
+    Runs in O(n) over the total number of drivers: the partitions are disjoint
+    exactly when their concatenated index has no duplicates.
     
     :param partitioned_drivers: List of GeoDataFrames, each corresponding to drivers within a specific isochrone, 
                                 and the last one containing drivers outside all isochrones.
     :return: True if all intersections are empty, False otherwise.
     """
-    num_partitions = len(partitioned_drivers)
-    for i in range(num_partitions):
-        for j in range(i + 1, num_partitions):
-            # Check if there is any common index between partition i and partition j
-            if not partitioned_drivers[i].index.isin(partitioned_drivers[j].index).any():
-                continue  # No common drivers, check the next pair
-            else:
-                # Found common drivers between partitions i and j
-                return False
-    return True
+    indices = [partition.index.to_numpy() for partition in partitioned_drivers]
+    if not indices:
+        return True
+    all_indices = np.concatenate(indices)
+    return len(pd.unique(all_indices)) == len(all_indices)
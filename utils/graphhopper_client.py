@@ -0,0 +1,153 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests as req
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from utils.cache_utils import SharedState
+from utils.metrics import timed, record_bytes
+
+
+class CircuitBreaker:
+    """
+    Fail fast while a service is down.
+
+    After `failure_threshold` consecutive failures the circuit opens and calls are
+    refused for `reset_timeout` seconds; then a single trial call is let through
+    and its outcome closes or re-opens the circuit. A trial that reports no outcome
+    within `reset_timeout`, e.g. from a killed background job, is given up.
+
+    The state lives in `state` under `name`: with a file-backed SharedState, every
+    process on the host trips and resets the same circuit, including background jobs
+    that exit after a single search.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, state=None, name="circuit-breaker"):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.shared = state or SharedState()
+        self.name = name
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def _update(self, transition):
+        def apply(state):
+            state = state or {"failures": 0, "opened_at": None, "trial_at": None}
+            return state, transition(state)
+        return self.shared.update(self.name, apply)
+
+    @property
+    def state(self):
+        def read(state):
+            if state["opened_at"] is None:
+                return "closed"
+            if time.time() - state["opened_at"] >= self.reset_timeout:
+                return "half-open"
+            return "open"
+        return self._update(read)
+
+    def allow(self) -> bool:
+        def transition(state):
+            if state["opened_at"] is None:
+                return True
+            now = time.time()
+            trial_due = state["trial_at"] is None or now - state["trial_at"] >= self.reset_timeout
+            if now - state["opened_at"] >= self.reset_timeout and trial_due:
+                state["trial_at"] = now
+                return True
+            return False
+        allowed = self._update(transition)
+        if not allowed:
+            with self._lock:
+                self.rejected += 1
+        return allowed
+
+    def record_success(self):
+        def transition(state):
+            state.update(failures=0, opened_at=None, trial_at=None)
+        self._update(transition)
+
+    def record_failure(self):
+        def transition(state):
+            state["failures"] += 1
+            state["trial_at"] = None
+            if state["opened_at"] is not None or state["failures"] >= self.failure_threshold:
+                state["opened_at"] = time.time()
+        self._update(transition)
+
+
+class IsochroneClient:
+    """
+    GraphHopper isochrone client with pooled keep-alive connections.
+
+    Every request has a (connect, read) timeout and is retried a bounded number of
+    times with backoff on connection errors and 502/503/504. Connection errors and
+    server errors count against a circuit breaker that refuses requests while
+    GraphHopper is down.
+
+    :param url: GraphHopper /isochrone endpoint
+    :param timeout: (connect, read) timeout in seconds
+    :param retries: Retries per request after the first attempt
+    :param pool_size: Keep-alive connections kept open to GraphHopper
+    """
+
+    def __init__(self, url, timeout=(3.05, 15), retries=2, backoff=0.3, pool_size=16, breaker=None):
+        self.url = url
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            raise_on_status=False,
+        )
+        self.session = req.Session()
+        self.session.mount(url.split("://", 1)[0] + "://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry))
+
+    def isochrones(self, lat: float, lon: float, time_limit: int, buckets: int, vehicle: str = "car"):
+        """
+        Isochrone polygons around a point.
+
+        :param time_limit: Largest time limit in seconds
+        :param buckets: Number of nested polygons to split it into
+        :return: list of GeoJSON features, or None on failure or while the circuit is open
+        """
+        if not self.breaker.allow():
+            print(f"GraphHopper circuit open, skipping isochrone request for {lat},{lon}")
+            return None
+        params = {
+            "point": f"{lat},{lon}",
+            "time_limit": time_limit,
+            "vehicle": vehicle,
+            "buckets": buckets
+        }
+        try:
+            with timed("graphhopper.isochrones"):
+                response = self.session.get(self.url, params=params, timeout=self.timeout)
+        except req.RequestException as e:
+            self.breaker.record_failure()
+            print(f"Failed to fetch isochrones: {e}")
+            return None
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        if response.status_code != 200:
+            print(f"Failed to fetch isochrones: {response.status_code}")
+            return None
+        record_bytes("graphhopper.isochrones", len(response.content))
+        features = response.json().get("polygons")
+        if features is None:
+            print("No features found in the response.")
+        return features
+
+
+def fetch_many(fetch, requests, max_concurrency=8):
+    """
+    Run `fetch(*request)` for every request on a bounded thread pool.
+
+    :return: results in the order of `requests`
+    """
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        return list(executor.map(lambda request: fetch(*request), requests))
@@ -0,0 +1,218 @@
+import os
+import json
+import zlib
+import random
+import sqlite3
+import argparse
+import threading
+from time import perf_counter
+from contextlib import contextmanager
+import numpy as np
+import shapely
+from shapely.geometry import shape
+from utils.cache_utils import cache_path
+from utils.graphhopper_client import fetch_many
+from utils.geo_utils import ISOCHRONE_CLIENT, calculate_isochrones, simplify_isochrones, CONTAINMENT_SIMPLIFY_TOLERANCE
+
+# Bounding box of the province of Madrid as (min lon, min lat, max lon, max lat)
+MADRID_BBOX = (-4.58, 39.88, -3.05, 41.17)
+# Square cells of this many degrees (0.02 is ~2 km north-south, ~1.7 km east-west)
+GRID_CELL_SIZE = 0.02
+# Every cell stores one ring per 5-minute bucket up to an hour, like the UI's range slider
+GRID_TIMES = list(range(5, 65, 5))
+GRID_INDEX_PATH = os.getenv("GRID_INDEX_PATH", cache_path("grid_index.sqlite"))
+
+
+def grid_cells(bbox=MADRID_BBOX, cell_size=GRID_CELL_SIZE):
+    """(row, col, lat, lon) of the center of every cell of a square grid over bbox."""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    rows = int(np.ceil((max_lat - min_lat) / cell_size))
+    cols = int(np.ceil((max_lon - min_lon) / cell_size))
+    return [
+        (row, col, min_lat + (row + 0.5) * cell_size, min_lon + (col + 0.5) * cell_size)
+        for row in range(rows) for col in range(cols)
+    ]
+
+@contextmanager
+def _open(path):
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        with conn:
+            _create_tables(conn)
+            yield conn
+    finally:
+        conn.close()
+
+def _create_tables(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS cells (
+            row INTEGER NOT NULL,
+            col INTEGER NOT NULL,
+            features BLOB NOT NULL,
+            PRIMARY KEY (row, col)
+        );
+    """)
+
+def build_grid_index(path=GRID_INDEX_PATH, bbox=MADRID_BBOX, cell_size=GRID_CELL_SIZE, times=GRID_TIMES,
+                     max_concurrency=8, chunk_size=200):
+    """
+    Precompute isochrones for every grid cell and store them in a compact SQLite index.
+
+    Rings are simplified with the containment tolerance, quantized and stored per
+    cell as zlib-compressed GeoJSON features. Cells are written chunk by chunk and
+    cells already in the index are skipped, so an interrupted build can be rerun.
+    The index is built straight from GraphHopper, bypassing the request cache.
+
+    :return: dict with build seconds, cells built/failed/total and index size in bytes
+    """
+    start = perf_counter()
+    with _open(path) as conn:
+        meta = {"bbox": list(bbox), "cell_size": cell_size, "times": list(times)}
+        stored = dict(conn.execute("SELECT key, value FROM meta;").fetchall())
+        if stored and {key: json.loads(value) for key, value in stored.items()} != meta:
+            raise ValueError(f"{path} was built with different parameters {stored}; use another path")
+        conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?);",
+                         [(key, json.dumps(value)) for key, value in meta.items()])
+        done = set(conn.execute("SELECT row, col FROM cells;").fetchall())
+
+    cells = [cell for cell in grid_cells(bbox, cell_size) if (cell[0], cell[1]) not in done]
+    built = failed = 0
+    for offset in range(0, len(cells), chunk_size):
+        chunk = cells[offset:offset + chunk_size]
+        requests = [(lat, lon, max(times) * 60, len(times)) for _, _, lat, lon in chunk]
+        results = fetch_many(ISOCHRONE_CLIENT.isochrones, requests, max_concurrency)
+        rows = []
+        for (row, col, _, _), features in zip(chunk, results):
+            if features is None:
+                failed += 1
+                continue
+            simplified, _ = simplify_isochrones(dict(type="FeatureCollection", features=features), CONTAINMENT_SIMPLIFY_TOLERANCE)
+            rows.append((row, col, zlib.compress(json.dumps(simplified["features"], separators=(",", ":")).encode())))
+        with _open(path) as conn:
+            conn.executemany("INSERT OR REPLACE INTO cells (row, col, features) VALUES (?, ?, ?);", rows)
+        built += len(rows)
+        print(f"Grid index: {len(done) + built} of {len(done) + len(cells)} cells built, {failed} failed")
+
+    report = {
+        "build_seconds": perf_counter() - start,
+        "cells_built": built,
+        "cells_failed": failed,
+        "cells_total": len(done) + len(cells),
+        "index_bytes": os.path.getsize(path),
+    }
+    print(f"Grid index built in {report['build_seconds']:.1f}s: {report['cells_built']} new cells, "
+          f"{report['cells_failed']} failed, {report['index_bytes'] / 2**20:.1f} MiB at {path}")
+    return report
+
+
+class GridIndex:
+    """Read side of a grid index: isochrones of the cell nearest to a point."""
+
+    def __init__(self, path=GRID_INDEX_PATH):
+        self.path = path
+        self._local = threading.local()
+        with _open(path) as conn:
+            meta = {key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM meta;").fetchall()}
+        if not meta:
+            raise ValueError(f"{path} is not a built grid index")
+        self.bbox = meta["bbox"]
+        self.cell_size = meta["cell_size"]
+        self.times = meta["times"]
+
+    def _conn(self):
+        if getattr(self._local, "conn", None) is None:
+            self._local.conn = sqlite3.connect(self.path, timeout=30)
+        return self._local.conn
+
+    def covers(self, times) -> bool:
+        return all(time_limit in self.times for time_limit in times)
+
+    def lookup(self, lat: float, lon: float, times: list):
+        """
+        FeatureCollection with one ring per requested time limit, from the nearest cell.
+
+        :return: FeatureCollection, or None if the point is outside the grid, the cell
+                 is missing or a time limit is not in the index
+        """
+        min_lon, min_lat, max_lon, max_lat = self.bbox
+        if not (min_lon <= lon <= max_lon and min_lat <= lat <= max_lat) or not self.covers(times):
+            return None
+        row = int((lat - min_lat) // self.cell_size)
+        col = int((lon - min_lon) // self.cell_size)
+        found = self._conn().execute("SELECT features FROM cells WHERE row = ? AND col = ?;", (row, col)).fetchone()
+        if found is None:
+            return None
+        features = json.loads(zlib.decompress(found[0]))
+        return dict(type="FeatureCollection", features=[features[self.times.index(t)] for t in times])
+
+
+_grid_index = {}
+_grid_index_lock = threading.Lock()
+
+def get_grid_index(path=GRID_INDEX_PATH):
+    """Shared GridIndex for `path`, or None if no index has been built there."""
+    with _grid_index_lock:
+        if path not in _grid_index:
+            _grid_index[path] = GridIndex(path) if os.path.exists(path) else None
+        return _grid_index[path]
+
+def measure_error(path=GRID_INDEX_PATH, samples=50, ranges=((5, 15), (20, 30), (35, 60)), seed=0):
+    """
+    Approximation error of the index against live GraphHopper isochrones at random points.
+
+    Each sample point is looked up for every [first, last] slider range, with one ring
+    every 5 minutes like the search page, so ranges that do not start at 5 minutes are
+    measured too. The error of a ring is the area of the symmetric difference between
+    indexed and live ring, relative to the live ring's area.
+
+    :return: dict keyed by (first, last) range of dicts with mean, 90th percentile and
+             max relative error per time limit
+    """
+    index = GridIndex(path)
+    rng = random.Random(seed)
+    min_lon, min_lat, max_lon, max_lat = index.bbox
+    range_times = {(first, last): list(range(first, last + 1, 5)) for first, last in ranges}
+    errors = {limits: {t: [] for t in times} for limits, times in range_times.items()}
+    for _ in range(samples):
+        lat, lon = rng.uniform(min_lat, max_lat), rng.uniform(min_lon, max_lon)
+        for limits, times in range_times.items():
+            approx = index.lookup(lat, lon, times)
+            live = calculate_isochrones(lat, lon, times)
+            if approx is None or live is None:
+                continue
+            for t, approx_feature, live_feature in zip(times, approx["features"], live["features"]):
+                live_ring = shapely.make_valid(shape(live_feature["geometry"]))
+                approx_ring = shapely.make_valid(shape(approx_feature["geometry"]))
+                if live_ring.area > 0:
+                    errors[limits][t].append(live_ring.symmetric_difference(approx_ring).area / live_ring.area)
+    report = {
+        limits: {
+            t: {
+                "samples": len(values),
+                "mean": float(np.mean(values)) if values else None,
+                "p90": float(np.percentile(values, 90)) if values else None,
+                "max": float(np.max(values)) if values else None,
+            } for t, values in limit_errors.items()
+        } for limits, limit_errors in errors.items()
+    }
+    for (first, last), limit_report in report.items():
+        for t, stats in limit_report.items():
+            if stats["samples"]:
+                print(f"{first}-{last} min range, {t} min: mean error {stats['mean']:.1%}, p90 {stats['p90']:.1%}, "
+                      f"max {stats['max']:.1%} over {stats['samples']} points")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or evaluate the precomputed Madrid isochrone grid")
+    parser.add_argument("command", choices=["build", "error"])
+    parser.add_argument("--path", default=GRID_INDEX_PATH)
+    parser.add_argument("--cell-size", type=float, default=GRID_CELL_SIZE, help="cell size in degrees")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent GraphHopper requests")
+    parser.add_argument("--samples", type=int, default=50, help="random points for the error report")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_grid_index(args.path, cell_size=args.cell_size, max_concurrency=args.workers)
+    else:
+        measure_error(args.path, samples=args.samples)
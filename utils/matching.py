@@ -0,0 +1,213 @@
+import csv
+import argparse
+from time import perf_counter
+import numpy as np
+import pandas as pd
+from utils.geo_utils import (
+    geoencode_address, calculate_isochrones_many, simplify_isochrones, label_drivers_by_isochrones,
+    CONTAINMENT_SIMPLIFY_TOLERANCE,
+)
+from utils.driver_reach import get_driver_reach_index, DRIVER_REACH_MINUTES
+from db.db_support import get_driver_snapshot
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:  # scipy is optional; fall back to a greedy assignment
+    linear_sum_assignment = None
+
+DEFAULT_TIMES = list(range(5, 35, 5))
+# Cost standing in for "unreachable" in the assignment; any real cost is far below it
+UNREACHABLE = 1e9
+
+
+def read_locations(path):
+    """
+    Read pickup/vehicle locations from a CSV.
+
+    Columns: id, and either lat and lon or street and postal_code. Optional shifts and
+    managers columns hold ;-separated names the matched driver must belong to.
+    """
+    locations = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            location = {
+                "id": row["id"],
+                "lat": float(row["lat"]) if row.get("lat") else None,
+                "lon": float(row["lon"]) if row.get("lon") else None,
+                "street": row.get("street"),
+                "postal_code": row.get("postal_code"),
+            }
+            for column in ("shifts", "managers"):
+                location[column] = [name.strip() for name in (row.get(column) or "").split(";") if name.strip()]
+            locations.append(location)
+    return locations
+
+def geocode_locations(locations):
+    """
+    Fill in lat and lon of the locations given by address, one at a time and through the geocode cache.
+
+    Geocoding stays serial on purpose: cache misses go to Nominatim, which allows one
+    request per second, so a thread pool would only queue on its rate limit.
+    """
+    for location in locations:
+        if location["lat"] is None or location["lon"] is None:
+            coords = geoencode_address(location["street"] or "", location["postal_code"])
+            if coords is not None:
+                location["lat"], location["lon"] = coords
+
+def compute_reach(locations, times=DEFAULT_TIMES, max_workers=8):
+    """
+    Geocode the locations, then fetch all their isochrones concurrently; both go through their caches.
+
+    :return: list aligned with locations of containment-simplified isochrones, or None when unreachable
+    """
+    geocode_locations(locations)
+    located = [i for i, location in enumerate(locations) if location["lat"] is not None and location["lon"] is not None]
+    requests = [(float(locations[i]["lat"]), float(locations[i]["lon"]), times) for i in located]
+    reaches = [None] * len(locations)
+    for i, isochrones in zip(located, calculate_isochrones_many(requests, max_workers)):
+        if isochrones is not None:
+            reaches[i] = simplify_isochrones(isochrones, CONTAINMENT_SIMPLIFY_TOLERANCE)[0]
+    return reaches
+
+def build_cost_matrix(drivers_gdf, locations, reaches, times=DEFAULT_TIMES):
+    """
+    Travel-time upper bounds in minutes, one row per location and one column per driver.
+
+    A driver's time to a location is the limit of the innermost ring containing it;
+    drivers outside every ring, or not in the location's shifts/managers, are UNREACHABLE.
+    calculate_isochrones returns one ring per time limit, so `times` are the ring limits.
+    """
+    cost = np.full((len(locations), len(drivers_gdf)), UNREACHABLE)
+    ring_minutes = np.append(np.asarray(times, dtype=float), UNREACHABLE)
+    for i, (location, isochrones) in enumerate(zip(locations, reaches)):
+        if isochrones is None:
+            continue
+        allowed = location_filters(drivers_gdf, location)
+        labels = label_drivers_by_isochrones(drivers_gdf[allowed], isochrones)
+        cost[i, np.flatnonzero(allowed)] = ring_minutes[labels]
+    return cost
+
+def location_filters(drivers_gdf, location) -> np.ndarray:
+    """Mask of the drivers in the location's shifts and managers (all when it names none)."""
+    allowed = np.ones(len(drivers_gdf), dtype=bool)
+    if location["shifts"]:
+        allowed &= drivers_gdf["shift"].isin(location["shifts"]).to_numpy()
+    if location["managers"]:
+        allowed &= drivers_gdf["manager"].isin(location["managers"]).to_numpy()
+    return allowed
+
+def build_reach_cost_matrix(drivers_gdf, locations, reach_index, minutes=DRIVER_REACH_MINUTES):
+    """
+    Cost matrix like build_cost_matrix, from the drivers' precomputed reach polygons instead of routing.
+
+    A driver costs `minutes` for every location inside its DriverReach polygon and is
+    UNREACHABLE for the rest, so no isochrone is requested for any location.
+    """
+    cost = np.full((len(locations), len(drivers_gdf)), UNREACHABLE)
+    located = np.array([i for i, location in enumerate(locations) if location["lat"] is not None and location["lon"] is not None])
+    if not len(located) or not len(drivers_gdf):
+        return cost
+    points, kendra_ids = reach_index.drivers_reaching_many(
+        [locations[i]["lat"] for i in located], [locations[i]["lon"] for i in located])
+    columns = pd.Index(drivers_gdf["kendra_id"]).get_indexer(kendra_ids)
+    known = columns >= 0  # Drivers with a polygon but filtered out of drivers_gdf
+    cost[located[points[known]], columns[known]] = minutes
+    for i in located:
+        cost[i, ~location_filters(drivers_gdf, locations[i])] = UNREACHABLE
+    return cost
+
+def solve_assignment(cost):
+    """
+    One-to-one assignment of locations (rows) to drivers (columns) minimizing total cost.
+
+    Uses the Hungarian algorithm from scipy when available, otherwise assigns the
+    cheapest remaining pairs greedily. Unreachable pairs are never returned.
+
+    :return: list of (row, column) pairs
+    """
+    if not cost.size:
+        return []
+    if linear_sum_assignment is not None:
+        rows, columns = linear_sum_assignment(cost)
+        pairs = zip(rows.tolist(), columns.tolist())
+    else:
+        pairs, used_rows, used_columns = [], set(), set()
+        for flat in np.argsort(cost, axis=None, kind="stable"):
+            row, column = divmod(int(flat), cost.shape[1])
+            if cost[row, column] >= UNREACHABLE:
+                break
+            if row not in used_rows and column not in used_columns:
+                pairs.append((row, column))
+                used_rows.add(row)
+                used_columns.add(column)
+    return [(row, column) for row, column in pairs if cost[row, column] < UNREACHABLE]
+
+def match_locations(locations, times=DEFAULT_TIMES, shifts=None, managers=None, max_workers=8, reach=False):
+    """
+    Match each location with at most one unmatched driver, minimizing total travel time.
+
+    :param locations: list of location dicts, as returned by read_locations
+    :param shifts: Only consider drivers in these shifts (all if empty)
+    :param managers: Only consider drivers of these managers (all if empty)
+    :param reach: Match on the drivers' precomputed DriverReach polygons instead of routing
+                  from every location; every match is then bounded by DRIVER_REACH_MINUTES
+    :return: DataFrame with one row per location: its id, the matched driver (if any) and the minutes bound
+    """
+    start = perf_counter()
+    drivers_df, drivers_gdf = get_driver_snapshot()
+    candidates = ~drivers_gdf["is_matched"].astype(bool).to_numpy()
+    if shifts:
+        candidates &= drivers_gdf["shift"].isin(shifts).to_numpy()
+    if managers:
+        candidates &= drivers_gdf["manager"].isin(managers).to_numpy()
+    drivers_gdf = drivers_gdf[candidates]
+
+    if reach:
+        geocode_locations(locations)
+        reach_index = get_driver_reach_index()
+        reach_seconds = perf_counter() - start
+        cost = build_reach_cost_matrix(drivers_gdf, locations, reach_index)
+    else:
+        reaches = compute_reach(locations, times, max_workers)
+        reach_seconds = perf_counter() - start
+        cost = build_cost_matrix(drivers_gdf, locations, reaches, times)
+    # Only drivers reachable from some location can be assigned; drop the rest before solving
+    reachable = np.flatnonzero((cost < UNREACHABLE).any(axis=0))
+    pairs = solve_assignment(cost[:, reachable])
+
+    matches = {row: reachable[column] for row, column in pairs}
+    records = []
+    for i, location in enumerate(locations):
+        driver = drivers_gdf.iloc[matches[i]] if i in matches else None
+        records.append({
+            "location_id": location["id"],
+            "kendra_id": driver["kendra_id"] if driver is not None else None,
+            "name": driver["name"] if driver is not None else None,
+            "shift": driver["shift"] if driver is not None else None,
+            "manager": driver["manager"] if driver is not None else None,
+            "minutes": cost[i, matches[i]] if i in matches else None,
+        })
+    result = pd.DataFrame(records)
+    print(f"Matched {len(matches)} of {len(locations)} locations with {len(drivers_gdf)} candidate drivers "
+          f"in {perf_counter() - start:.1f}s ({reach_seconds:.1f}s computing reach)")
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Match unmatched drivers to many locations at once")
+    parser.add_argument("locations", help="CSV with id and lat/lon or street/postal_code per location")
+    parser.add_argument("--times", type=int, nargs="+", default=DEFAULT_TIMES, help="isochrone limits in minutes")
+    parser.add_argument("--shift", action="append", default=[], help="only match drivers in this shift")
+    parser.add_argument("--manager", action="append", default=[], help="only match drivers of this manager")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent isochrone requests")
+    parser.add_argument("--reach", action="store_true",
+                        help="match on the precomputed per-driver reach polygons instead of routing from every location")
+    parser.add_argument("--output", help="write the matches to this CSV instead of printing them")
+    args = parser.parse_args()
+
+    result = match_locations(read_locations(args.locations), sorted(args.times), args.shift, args.manager, args.workers,
+                             reach=args.reach)
+    if args.output:
+        result.to_csv(args.output, index=False)
+    else:
+        print(result.to_string(index=False))
@@ -0,0 +1,309 @@
+import os
+import json
+import time
+import uuid
+import bisect
+import sqlite3
+import threading
+import contextvars
+from time import perf_counter, monotonic
+from contextlib import contextmanager
+from utils.cache_utils import cache_path
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(11))  # 1 KiB to 1 GiB
+ROW_BUCKETS = (1, 10, 100, 1_000, 10_000, 100_000, 1_000_000)
+# JSON-lines file receiving one record per traced request; unset to disable tracing
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH")
+# SQLite file every process on the host flushes its samples to, so /metrics adds up all request
+# workers and background jobs; empty keeps the samples of each process to itself
+METRICS_DB_PATH = os.getenv("METRICS_DB_PATH", cache_path("metrics.sqlite")) or None
+# Seconds between two flushes of a process's samples
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", 5))
+ERRORS_METRIC = "automatch_stage_errors_total"
+# Process name under which the samples of exited processes are summed
+ARCHIVED_PROCESS = "archived"
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram with one series per stage."""
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, value):
+        with self._lock:
+            counts, total = self._series.get(stage, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._series[stage] = (counts, total + value)
+        maybe_flush()
+
+    def series(self) -> dict:
+        """Copy of this process's per-bucket counts and sum, keyed by stage."""
+        with self._lock:
+            return {stage: (list(counts), total) for stage, (counts, total) in self._series.items()}
+
+    def reset(self):
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def render(self, series) -> list:
+        """Text exposition of `series`, as returned by series() or summed over processes."""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for stage, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(list(self.buckets) + ["+Inf"], counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{stage="{stage}"}} {total}')
+            lines.append(f'{self.name}_count{{stage="{stage}"}} {cumulative}')
+        return lines
+
+
+STAGE_SECONDS = Histogram("automatch_stage_seconds", "Latency of each pipeline stage in seconds", LATENCY_BUCKETS)
+STAGE_BYTES = Histogram("automatch_stage_bytes", "Payload size produced or received by each stage in bytes", SIZE_BUCKETS)
+STAGE_ROWS = Histogram("automatch_stage_rows", "Rows returned or handled by each stage", ROW_BUCKETS)
+HISTOGRAMS = (STAGE_SECONDS, STAGE_BYTES, STAGE_ROWS)
+_errors = {}
+_errors_lock = threading.Lock()
+_gauges = []
+_trace = contextvars.ContextVar("trace", default=None)
+_trace_lock = threading.Lock()
+_process = {"id": uuid.uuid4().hex, "flushed_at": 0.0}
+_flush_lock = threading.Lock()
+
+
+def _after_fork_in_child():
+    """A forked process, such as a background job, counts only its own samples, under its own name."""
+    global _errors_lock, _trace_lock, _flush_lock
+    for histogram in HISTOGRAMS:
+        histogram.reset()
+    _errors.clear()
+    _errors_lock = threading.Lock()
+    _trace_lock = threading.Lock()
+    _flush_lock = threading.Lock()
+    _process.update(id=uuid.uuid4().hex, flushed_at=0.0)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+def _span(stage):
+    spans = _trace.get()
+    if spans is None:
+        return None
+    for span in reversed(spans):
+        if span["stage"] == stage:
+            return span
+    span = {"stage": stage}
+    spans.append(span)
+    return span
+
+@contextmanager
+def timed(stage):
+    """
+    Record the latency of a stage; use as `with timed("stage"):` or as a `@timed("stage")` decorator.
+
+    Exceptions are counted per stage and re-raised. Inside a trace() the stage is also
+    added to the request's trace record.
+    """
+    spans = _trace.get()
+    span = {"stage": stage} if spans is not None else None
+    if span is not None:
+        spans.append(span)
+    start = perf_counter()
+    try:
+        yield
+    except Exception:
+        with _errors_lock:
+            _errors[stage] = _errors.get(stage, 0) + 1
+        if span is not None:
+            span["error"] = True
+        raise
+    finally:
+        seconds = perf_counter() - start
+        STAGE_SECONDS.observe(stage, seconds)
+        if span is not None:
+            span["seconds"] = round(seconds, 6)
+
+def record_rows(stage, rows):
+    STAGE_ROWS.observe(stage, rows)
+    span = _span(stage)
+    if span is not None:
+        span["rows"] = rows
+
+def record_bytes(stage, size):
+    STAGE_BYTES.observe(stage, size)
+    span = _span(stage)
+    if span is not None:
+        span["bytes"] = size
+
+def register_gauge(name, help, collect, label="name"):
+    """
+    Expose the value of `collect()` at every scrape.
+
+    :param collect: Returns a number, or a dict of numbers keyed by the value of `label`
+    """
+    _gauges.append((name, help, collect, label))
+
+@contextmanager
+def trace(name, **fields):
+    """Collect the stages timed inside the block into one JSON line of TRACE_LOG_PATH."""
+    if not TRACE_LOG_PATH:
+        yield
+        return
+    spans = []
+    token = _trace.set(spans)
+    started_at = time.time()
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        _trace.reset(token)
+        record = {
+            "trace": name,
+            "started_at": started_at,
+            "seconds": round(perf_counter() - start, 6),
+            "pid": os.getpid(),
+            **fields,
+            "spans": spans,
+        }
+        with _trace_lock, open(TRACE_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+
+def local_samples() -> dict:
+    """Cumulative samples of this process as {(metric, stage): (counts, sum)}; error counters have one count."""
+    samples = {}
+    for histogram in HISTOGRAMS:
+        for stage, series in histogram.series().items():
+            samples[(histogram.name, stage)] = series
+    with _errors_lock:
+        for stage, count in _errors.items():
+            samples[(ERRORS_METRIC, stage)] = ([count], 0.0)
+    return samples
+
+@contextmanager
+def _metrics_db():
+    conn = sqlite3.connect(METRICS_DB_PATH, timeout=30)
+    try:
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS samples (
+                    process TEXT NOT NULL,
+                    pid INTEGER NOT NULL,
+                    metric TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    counts TEXT NOT NULL,
+                    total REAL NOT NULL,
+                    PRIMARY KEY (process, metric, stage)
+                );
+            """)
+            yield conn
+    finally:
+        conn.close()
+
+def flush(force=True):
+    """
+    Replace this process's row set in METRICS_DB_PATH with its current cumulative samples.
+
+    Called every METRICS_FLUSH_SECONDS from observe(), and explicitly at the end of work
+    done in a short-lived process, whose samples would otherwise be lost when it exits.
+    """
+    if not METRICS_DB_PATH:
+        return
+    with _flush_lock:
+        if not force and monotonic() - _process["flushed_at"] < METRICS_FLUSH_SECONDS:
+            return
+        _process["flushed_at"] = monotonic()
+        rows = [
+            (_process["id"], os.getpid(), metric, stage, json.dumps(counts), total)
+            for (metric, stage), (counts, total) in local_samples().items()
+        ]
+        try:
+            with _metrics_db() as conn:
+                conn.execute("DELETE FROM samples WHERE process = ?;", (_process["id"],))
+                conn.executemany("INSERT INTO samples VALUES (?, ?, ?, ?, ?, ?);", rows)
+        except sqlite3.Error as e:
+            print(f"Failed to flush metrics: {e}")
+
+def maybe_flush():
+    if METRICS_DB_PATH and monotonic() - _process["flushed_at"] >= METRICS_FLUSH_SECONDS:
+        flush(force=False)
+
+def _pid_alive(pid) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _add(samples, key, counts, total):
+    if key in samples:
+        previous_counts, previous_total = samples[key]
+        counts = [a + b for a, b in zip(previous_counts, counts)]
+        total += previous_total
+    samples[key] = (counts, total)
+
+def shared_samples() -> dict:
+    """
+    Samples summed over every process that flushed to METRICS_DB_PATH, this one included.
+
+    Rows of exited processes are folded into one archived row set, so counters stay
+    monotonic while the table only grows with the number of live processes.
+    """
+    if not METRICS_DB_PATH:
+        return local_samples()
+    flush()
+    try:
+        with _metrics_db() as conn:
+            conn.execute("BEGIN IMMEDIATE;")
+            rows = conn.execute("SELECT process, pid, metric, stage, counts, total FROM samples;").fetchall()
+            exited = {process for process, pid, *_ in rows if process != ARCHIVED_PROCESS and not _pid_alive(pid)}
+            archived, samples = {}, {}
+            for process, pid, metric, stage, counts, total in rows:
+                counts = json.loads(counts)
+                _add(samples, (metric, stage), counts, total)
+                if process == ARCHIVED_PROCESS or process in exited:
+                    _add(archived, (metric, stage), counts, total)
+            if exited:
+                conn.execute(f"DELETE FROM samples WHERE process IN (?, {', '.join(['?'] * len(exited))});",
+                             [ARCHIVED_PROCESS, *exited])
+                conn.executemany("INSERT INTO samples VALUES (?, 0, ?, ?, ?, ?);", [
+                    (ARCHIVED_PROCESS, metric, stage, json.dumps(counts), total)
+                    for (metric, stage), (counts, total) in archived.items()
+                ])
+    except sqlite3.Error as e:
+        print(f"Failed to read shared metrics, reporting this process only: {e}")
+        return local_samples()
+    return samples
+
+def render_prometheus() -> str:
+    """
+    Histograms and error counters of every process on the host, in the Prometheus text format.
+
+    Gauges describe the process answering the scrape.
+    """
+    samples = shared_samples()
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines += histogram.render({stage: series for (metric, stage), series in samples.items() if metric == histogram.name})
+    lines += [f"# HELP {ERRORS_METRIC} Exceptions raised per stage", f"# TYPE {ERRORS_METRIC} counter"]
+    lines += [f'{ERRORS_METRIC}{{stage="{stage}"}} {counts[0]}'
+              for (metric, stage), (counts, _) in sorted(samples.items()) if metric == ERRORS_METRIC]
+    for name, help, collect, label in _gauges:
+        try:
+            values = collect()
+        except Exception as e:
+            print(f"Failed to collect gauge {name}: {e}")
+            continue
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+        if isinstance(values, dict):
+            lines += [f'{name}{{{label}="{key}"}} {float(value)}' for key, value in sorted(values.items())]
+        else:
+            lines.append(f"{name} {float(values)}")
+    return "\n".join(lines) + "\n"
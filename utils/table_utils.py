@@ -0,0 +1,155 @@
+import os
+import uuid
+from dash import dash_table, html
+from pandas.api.types import is_bool_dtype, is_numeric_dtype
+from utils.cache_utils import TTLCache, cache_path
+from utils.metrics import timed
+
+PAGE_SIZE = 10
+# Partition results are kept on disk so that any worker can serve the next page
+PARTITION_CACHE = TTLCache(
+    maxsize=int(os.getenv("PARTITION_CACHE_SIZE", 32)),
+    ttl=int(os.getenv("PARTITION_CACHE_TTL", 60 * 60)),
+    path=os.getenv("PARTITION_CACHE_PATH", cache_path("partitions.sqlite")) or None,
+)
+
+# DataTable filter_query operators, longest first so "<=" is not read as "<"
+FILTER_OPERATORS = [
+    ("ge", ">="), ("le", "<="), ("ne", "!="), ("eq", "="), ("lt", "<"), ("gt", ">"),
+    ("contains", "contains"), ("datestartswith", "datestartswith"),
+]
+# Relational operators, applied to the column and value once both are of one type
+COMPARISONS = {
+    "eq": lambda series, value: series == value,
+    "ne": lambda series, value: series != value,
+    "lt": lambda series, value: series < value,
+    "le": lambda series, value: series <= value,
+    "gt": lambda series, value: series > value,
+    "ge": lambda series, value: series >= value,
+}
+
+
+def cache_partitions(partitions) -> str:
+    """Store the table partitions server-side and return the token that pages them."""
+    token = uuid.uuid4().hex
+    PARTITION_CACHE.set(token, partitions)
+    return token
+
+def split_filter_part(filter_part):
+    """
+    Parse one `{column} op value` clause of a DataTable filter_query.
+
+    The value is returned as typed, without its quotes; filter_sort_page converts it
+    to the type of the column it is compared with.
+
+    :return: (column, operator, value), or (None, None, None) if the clause is not understood
+    """
+    for name, symbol in FILTER_OPERATORS:
+        for operator in (f" {name} ", f" {symbol} "):
+            if operator not in filter_part:
+                continue
+            column_part, value_part = filter_part.split(operator, 1)
+            column = column_part[column_part.find("{") + 1:column_part.rfind("}")]
+            value = value_part.strip()
+            if value and value[0] == value[-1] and value[0] in ("'", '"', "`"):
+                value = value[1:-1].replace("\\" + value[0], value[0])
+            return column, name, value
+    return None, None, None
+
+def comparable(series, value):
+    """
+    A column and a filter value in one comparable type: numbers for numeric columns, text otherwise.
+
+    :return: (series, value), or None if the value is not a number and the column is numeric
+    """
+    if is_numeric_dtype(series) and not is_bool_dtype(series):
+        try:
+            return series, float(value)
+        except ValueError:
+            return None
+    # Missing values stay missing instead of comparing as "None" or "nan"
+    return series.astype("string"), str(value)
+
+def filter_sort_page(df, filter_query, sort_by, page_current, page_size=PAGE_SIZE):
+    """
+    Apply a DataTable's custom filter, sort and paging to a DataFrame.
+
+    :return: (records of the requested page, number of pages, number of matching rows)
+    """
+    if filter_query:
+        for filter_part in filter_query.split(" && "):
+            column, operator, value = split_filter_part(filter_part)
+            if column not in df.columns:
+                continue
+            if operator in COMPARISONS:
+                operands = comparable(df[column], value)
+                if operands is None:
+                    continue  # Text typed in a numeric column is ignored rather than failing the page
+                df = df[COMPARISONS[operator](*operands).fillna(False).astype(bool)]
+            elif operator == "contains":
+                df = df[df[column].astype(str).str.contains(str(value), case=False, regex=False, na=False)]
+            elif operator == "datestartswith":
+                df = df[df[column].astype(str).str.startswith(str(value), na=False)]
+
+    if sort_by:
+        df = df.sort_values(
+            [column["column_id"] for column in sort_by],
+            ascending=[column["direction"] == "asc" for column in sort_by],
+            inplace=False,
+        )
+
+    page_current = page_current or 0
+    num_rows = len(df)
+    page_count = max(1, -(-num_rows // page_size))
+    page = df.iloc[page_current * page_size:(page_current + 1) * page_size]
+    return page.to_dict("records"), page_count, num_rows
+
+def page_partition(token, index, page_current, page_size=PAGE_SIZE, sort_by=None, filter_query=None):
+    """
+    Serve one page of a cached partition.
+
+    :return: (records, page_count), or None if the token expired
+    """
+    partitions = PARTITION_CACHE.get(token) if token else None
+    if partitions is None or index >= len(partitions):
+        return None
+    records, page_count, _ = filter_sort_page(partitions[index], filter_query, sort_by, page_current, page_size)
+    return records, page_count
+
+@timed("callback.build_tables")
+def build_partition_tables(partitions, time_limits, uncounted_outside=0):
+    """
+    One titled DataTable per partition, holding only its first page; later pages come from page_partition.
+
+    :param partitions: DataFrames of drivers per ring, the last one holding drivers outside all rings
+    :param time_limits: [first, last] isochrone limits in minutes, as chosen on the range slider
+    :param uncounted_outside: Drivers outside all rings that were counted but not loaded into the last partition
+    """
+    data_tables = []
+    num_partitions = len(partitions)
+    for i, partition in enumerate(partitions):
+        first_page, page_count, number_of_drivers = filter_sort_page(partition, None, None, 0)
+        table = dash_table.DataTable(
+            id={'type': 'drivers-table', 'index': i},
+            columns=[{"name": col, "id": col} for col in partition.columns],
+            data=first_page,
+            style_table={'overflowX': 'auto'},
+            page_current=0,
+            page_size=PAGE_SIZE,
+            page_count=page_count,
+            page_action='custom',
+            sort_action='custom',
+            sort_mode='multi',
+            sort_by=[],
+            filter_action='custom',
+            filter_query='',
+            style_cell={'textAlign': 'left'},
+        )
+        if i < num_partitions - 1:
+            iso_title = time_limits[0] + i * 5
+            title = f'{number_of_drivers} drivers within {iso_title} minutes of chosen location'
+        else:
+            # This is the last partition, so we give it a custom title
+            title = f'{number_of_drivers + uncounted_outside} drivers outside largest isochrone'
+        data_tables.append(html.Div(children=[html.H3(title), table], style={'margin': '20px'}))
+    return data_tables